@@ -0,0 +1,62 @@
+import pandas as pd
+
+##################################################################
+### Columnar activity summaries
+##################################################################
+
+# pandas frequency of the period starts and the label format for each period
+periodFrequencies = {'day': 'D', 'week': 'W-MON', 'month': 'MS', 'year': 'YS'}
+periodLabels = {'day': '%d-%b-%Y', 'week': '%G-W%V', 'month': '%b', 'year': '%Y'}
+
+
+# one row per activity. distance is in km, times in seconds, climb in m.
+# startTime is kept in UTC as recorded in the tcx files
+def buildActivityTable(dataSets, stats):
+    table = pd.DataFrame({'name': [dataSet.name for dataSet in dataSets],
+                          'startTime': pd.to_datetime([dataSet.startTime for dataSet in dataSets], utc=True),
+                          'distance': [dataSet.distance/1000 for dataSet in dataSets],
+                          'duration': [dataSet.duration for dataSet in dataSets],
+                          })
+    for key in stats:
+        table[key] = stats[key]
+    table['climb'] = table['elevationGain']
+    table['moving'] = table['movingTime']/60/60
+    table['year'] = table['startTime'].dt.year
+    return table
+
+
+# start of the day/week/month/year each time falls in. Weeks start on Monday as ISO weeks do
+def periodStart(times, period):
+    days = pd.DatetimeIndex(times).tz_localize(None).normalize()
+    if period == 'day':
+        return days
+    if period == 'week':
+        return days - pd.to_timedelta(days.weekday, unit='D')
+    return days.to_period('M' if period == 'month' else 'Y').start_time
+
+
+# totals of columns per period of the activities between the start and end dates (inclusive),
+# with empty periods filled with zero. Activities outside the dates are left out even when
+# their period overlaps them, so a week spanning new year only counts the requested year's
+# walks. cumulative is the running distance, restarted each calendar year, where a period
+# starting before the start date counts towards the year of the start date. Returns a frame
+# indexed by period start with a label column.
+# A week is labelled with its ISO year and week, so the week starting 30-Dec-2024 is 2025-W01
+def aggregate(table, period, start, end, columns=('distance', 'climb', 'moving')):
+    columns = list(columns)
+    rangeStart, rangeEnd = pd.Timestamp(start), pd.Timestamp(end)
+    days = periodStart(table['startTime'], 'day')
+    inRange = (days >= rangeStart) & (days <= rangeEnd)
+    starts = periodStart(table['startTime'][inRange], period)
+    totals = table.loc[inRange, columns].groupby(starts).sum()
+
+    first = periodStart([rangeStart], period)[0]
+    index = pd.date_range(first, rangeEnd, freq=periodFrequencies[period])
+    totals = totals.reindex(index.union(totals.index), fill_value=0)
+    totals = totals[(totals.index >= first) & (totals.index <= rangeEnd)]
+
+    totalYears = totals.index.where(totals.index >= rangeStart, rangeStart).year
+    totals['cumulative'] = totals['distance'].groupby(totalYears).cumsum()
+    totals['label'] = totals.index.strftime(periodLabels[period])
+    totals.index.name = 'start'
+    return totals
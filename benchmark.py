@@ -0,0 +1,182 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import datetime
+import subprocess
+from stageProfile import peakMemory, cpuTime
+
+##################################################################
+### PROCESSING AND PATH PARAMETERS
+##################################################################
+
+# archive sizes to benchmark, in activities
+sizes = [100, 1000, 10000]
+
+# synthetic archives and build output go in workFolder/<size>, archives are reused
+# between runs when they were generated with the same settings
+workFolder = 'bench'
+
+# results file, compare it between changes to spot regressions
+resultFile = os.path.join(workFolder, 'benchmark.json')
+
+# years the synthetic activities are spread over, the last is built as the year page
+benchYears = [2023, 2024]
+
+##################################################################
+### Measurement
+##################################################################
+
+# run one stage and record its wall and cpu time and the peak memory after it
+def runStage(stages, name, items, func, *args):
+    wall = time.perf_counter()
+    cpu = cpuTime()
+    result = func(*args)
+    peak, peakWorkers = peakMemory()
+    stages.append({'stage': name,
+                   'items': items,
+                   'wall': round(time.perf_counter() - wall, 4),
+                   'cpu': round(cpuTime() - cpu, 4),
+                   'peakMemory': peak,
+                   'peakWorkerMemory': peakWorkers,
+                   })
+    return result
+
+# build the page for the archive in the current folder one stage at a time, run in a
+# fresh process for each size so the peak memory belongs to that size alone
+def benchmarkBuild(jobs):
+    import numpy as np
+    import plotWalkData
+    from activityTable import buildActivityTable
+
+    # parse from scratch, then again from the cache
+    if os.path.isdir(plotWalkData.cacheFolder):
+        shutil.rmtree(plotWalkData.cacheFolder)
+    year = benchYears[-1]
+    dataFiles = []
+    for buildYear in plotWalkData.findYears():
+        dataFiles += plotWalkData.findDataFiles(buildYear)
+
+    stages = []
+    dataSets, loadedFiles = runStage(stages, 'parse', len(dataFiles), plotWalkData.loadTracks, dataFiles, jobs)
+    runStage(stages, 'parse cached', len(dataFiles), plotWalkData.loadTracks, dataFiles, jobs)
+    points = int(sum(len(dataSet) for dataSet in dataSets))
+
+    index = runStage(stages, 'index', points, plotWalkData.indexTracks, dataSets, loadedFiles)
+    hmData, tracks, infos, stats = runStage(stages, 'merge', points, plotWalkData.mergeTracks, dataSets)
+
+    def aggregateStage():
+        table = buildActivityTable(dataSets, stats)
+        return table, plotWalkData.aggregateDistances(table, year)
+    table, (monthData, weekData) = runStage(stages, 'aggregate', len(dataSets), aggregateStage)
+
+    selected = np.arange(len(dataSets))
+    coverage = runStage(stages, 'coverage', len(dataSets), plotWalkData.createCoverage, index, table, dataSets, selected)
+    plots = runStage(stages, 'plots', len(monthData) + len(weekData), plotWalkData.createPlots, monthData, weekData)
+    layers = runStage(stages, 'map layers', points, plotWalkData.createMapLayers, 'Tracks', 'all', hmData, tracks, infos)
+    m = runStage(stages, 'map', len(tracks), plotWalkData.createMap, [layers])
+    mapFile = runStage(stages, 'folium render', len(tracks), plotWalkData.renderMap, m, 'index_map.html')
+    script, divs = runStage(stages, 'bokeh embed', len(plots), plotWalkData.embedPlots, plots)
+    notes = plotWalkData.createNotes(table)
+    runStage(stages, 'html write', 1, plotWalkData.createHtml, 'index.html', mapFile, script, divs,
+             notes, coverage, [], [])
+
+    return {'activities': len(dataSets),
+            'points': points,
+            'htmlBytes': os.path.getsize('index.html'),
+            'mapBytes': os.path.getsize(mapFile),
+            'stages': stages,
+            }
+
+##################################################################
+### Archives and runs
+##################################################################
+
+# total size of the files under a folder
+def folderSize(folder):
+    return sum(os.path.getsize(os.path.join(root, file)) for root, dirs, files in os.walk(folder) for file in files)
+
+# write the synthetic archive for a size unless one with the same settings is already there
+def prepareArchive(folder, size, seed, maxMinutes):
+    import syntheticTcx
+    dataFolder = os.path.join(folder, 'data')
+    settingsFile = os.path.join(folder, 'archive.json')
+    settings = {'size': size, 'seed': seed, 'maxMinutes': maxMinutes, 'years': benchYears,
+                'timeOnlyPoints': syntheticTcx.timeOnlyPoints}
+    if os.path.isfile(settingsFile):
+        with open(settingsFile, 'r') as f:
+            if json.load(f) == settings:
+                return
+    if os.path.isdir(folder):
+        shutil.rmtree(folder)
+    os.makedirs(folder)
+    syntheticTcx.generateArchive(dataFolder, size, benchYears, seed=seed, maxMinutes=maxMinutes)
+    with open(settingsFile, 'w') as f:
+        json.dump(settings, f)
+
+# benchmark each size in its own process and write the results
+def benchmark(sizes, jobs=1, seed=0, maxMinutes=None):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    results = {'created': datetime.datetime.now().isoformat(timespec='seconds'),
+               'commit': commit,
+               'python': platform.python_version(),
+               'platform': platform.platform(),
+               'jobs': jobs,
+               'runs': [],
+               }
+
+    for size in sizes:
+        folder = os.path.join(workFolder, str(size))
+        print('Preparing ' + str(size) + ' activities in ' + folder)
+        prepareArchive(folder, size, seed, maxMinutes)
+
+        print('Building ' + str(size) + ' activities')
+        runFile = os.path.join(folder, 'run.json')
+        with open(os.path.join(folder, 'build.log'), 'w') as log:
+            subprocess.run([sys.executable, os.path.abspath(__file__), '--run', folder, '--jobs', str(jobs)],
+                           stdout=log, check=True)
+        with open(runFile, 'r') as f:
+            run = json.load(f)
+        run['size'] = size
+        run['archiveBytes'] = folderSize(os.path.join(folder, 'data'))
+        results['runs'].append(run)
+
+        for stage in run['stages']:
+            print('  {:<14} {:>9.3f}s wall {:>9.3f}s cpu {:>9} MB'.format(stage['stage'], stage['wall'], stage['cpu'],
+                                                                        str(stage['peakMemory'])))
+        print('  ' + str(run['points']) + ' points, ' + str(round(run['archiveBytes'] / 1e6, 1)) + ' MB of tcx, ' +
+              str(round(run['htmlBytes'] / 1e6, 2)) + ' MB of html, ' + str(round(run['mapBytes'] / 1e6, 2)) + ' MB of map')
+
+    with open(resultFile, 'w') as f:
+        json.dump(results, f, indent=1)
+    print('Wrote ' + resultFile)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time each stage of the page build on synthetic archives')
+    parser.add_argument('--sizes', type=int, nargs='+', default=sizes,
+                        help='archive sizes in activities (default: %(default)s)')
+    parser.add_argument('--jobs', type=int, default=1, help='number of processes used to parse tracks (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the archives (default: %(default)s)')
+    parser.add_argument('--max-minutes', type=float, default=None,
+                        help='cap on synthetic walk length, to keep the larger archives small')
+    parser.add_argument('--output', default=resultFile, help='results file (default: %(default)s)')
+    parser.add_argument('--run', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        # child process - build the archive in the given folder
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        os.chdir(args.run)
+        run = benchmarkBuild(args.jobs)
+        with open('run.json', 'w') as f:
+            json.dump(run, f, indent=1)
+    else:
+        resultFile = args.output
+        benchmark(args.sizes, jobs=args.jobs, seed=args.seed, maxMinutes=args.max_minutes)
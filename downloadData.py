@@ -1,58 +1,252 @@
-import requests
 import datetime
 import pandas as pd
 import os
 import re
-import win32api
-import time
-
-# downloads folder default
-downloadFolder = r'C:\Users\scott\Downloads'
-
-# # file with lifetime data - This is up to 2-Nov-2024
-# lifetimeDataFile = "user41688257_workout_history.csv"
-
-# # file with lifetime data - 3-Nov-2024 to 27-Dec-2024
-# lifetimeDataFile = "user41688257_workout_history_2024-12-28.csv"
-
-# file with 28-Dec-2024 to end of year
-lifetimeDataFile = "user41688257_workout_history_2024-12-31.csv"
-
-# year to download
-year = 2024
-
-# load data from csv
-summary = pd.read_csv(lifetimeDataFile)
-
-# if data folder does not exist, make it
-if not os.path.isdir('data'):
-    os.mkdir('data')
-if not os.path.isdir(os.path.join('data', str(year))):
-    os.mkdir(os.path.join('data', str(year)))
-
-# specify path for downloading data
-downloadPath = os.path.join('data', str(year))
-
-# loop through rows and download data
-count = 0
-for iii in range(0, len(summary)):
-    if '2024' in summary['Workout Date'][iii]:
-        # download file
-        win32api.ShellExecute(None,
-                              'open',
-                              summary['Link'][iii].replace('/workout', '/workout/export') + '/tcx',
-                              None,
-                              '.',
-                              0)
-        count += 1
-        time.sleep(1)
-
-# look for downloaded files of expected format and move
-moved = 0
-while moved < count:
-    files = os.listdir(downloadFolder)
-    for file in files:
-        if os.path.splitext(file)[1] == '.tcx':
-            if datetime.datetime.fromtimestamp(os.path.getctime(os.path.join(downloadFolder, file))).date() == datetime.datetime.now().date():
-                os.replace(os.path.join(downloadFolder, file), os.path.join(downloadPath, file))
-                moved += 1
\ No newline at end of file
+import glob
+import json
+import argparse
+import threading
+import urllib.parse
+import concurrent.futures
+from trackCache import TrackCache, parseFile
+from trackArchive import TrackArchive, archiveName
+
+##################################################################
+### PROCESSING AND PATH PARAMETERS
+##################################################################
+
+# workout history exports from MapMyRun, all matching files are merged.
+# earlier exports were:
+#   user41688257_workout_history.csv            - lifetime data up to 2-Nov-2024
+#   user41688257_workout_history_2024-12-28.csv - 3-Nov-2024 to 27-Dec-2024
+#   user41688257_workout_history_2024-12-31.csv - 28-Dec-2024 to end of year
+historyFilePattern = 'user*_workout_history*.csv'
+
+# base data folder, tcx files are saved in data/<year>
+dataFolder = 'data'
+
+# record of which workout ID was saved to which file
+syncManifest = os.path.join(dataFolder, 'workouts.json')
+
+# folder for parsed track cache, shared with plotWalkData.py
+cacheFolder = 'cache'
+
+# years to download when none are given
+years = [2024]
+
+# number of concurrent downloads
+connections = 4
+
+# request timeout in seconds
+timeout = 60
+
+# a tcx file has this root element near its start, anything else such as a login page
+# is not saved
+tcxRoot = b'<TrainingCenterDatabase'
+
+# held while a download picks its final file name, so workouts with the same name
+# fetched at the same time don't write to the same file
+nameLock = threading.Lock()
+
+##################################################################
+### Workout history
+##################################################################
+
+# pull the numeric workout ID out of a link like http://www.mapmyride.com/workout/8340216139
+def workoutId(link):
+    match = re.search(r'/workout/(\d+)', link)
+    return match.group(1) if match else None
+
+# parse a history date such as 'Dec. 31, 2024', 'Sept. 1, 2024' or 'June 30, 2024'
+def parseWorkoutDate(text):
+    month, day, year = text.replace('.', '').replace(',', '').split()
+    return datetime.datetime.strptime(month[:3] + ' ' + day + ' ' + year, '%b %d %Y').date()
+
+# merge all history exports and drop workouts that appear in more than one of them
+def loadHistory(historyFiles):
+    summary = pd.concat([pd.read_csv(file) for file in historyFiles], ignore_index=True)
+    summary['ID'] = summary['Link'].map(workoutId)
+    summary = summary.dropna(subset=['ID']).drop_duplicates(subset='ID', keep='first')
+    summary['Date'] = summary['Workout Date'].map(parseWorkoutDate)
+    return summary.reset_index(drop=True)
+
+##################################################################
+### Sync
+##################################################################
+
+# load the workout ID to file record
+def loadManifest():
+    if os.path.isfile(syncManifest):
+        with open(syncManifest, 'r') as f:
+            return json.load(f)
+    return {}
+
+def saveManifest(manifest):
+    with open(syncManifest, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+# source files of the activities in the archive of a download folder. Imported tcx files
+# can be deleted, so these count as downloaded even when the file is gone
+def archivedKeys(downloadPath):
+    archiveFile = os.path.join(downloadPath, archiveName)
+    if not os.path.isfile(archiveFile):
+        return []
+    with TrackArchive(archiveFile) as archive:
+        return list(archive.keys)
+
+# match workouts to tcx files already in the download folder that are not in the manifest
+# yet, e.g. files downloaded by hand, and to archived activities whose tcx file has been
+# deleted. A file matches a workout when the distance agrees to within a metre and the
+# date to within a day (history dates are local, tcx times UTC). A dry run parses the
+# files without adding them to the track cache
+def matchExisting(workouts, downloadPath, manifest, dryRun=False):
+    known = set(manifest.values())
+    files = [os.path.join(downloadPath, file) for file in sorted(os.listdir(downloadPath))
+             if file.endswith('.tcx')]
+    files = [file for file in files if TrackCache.key(file) not in known]
+    archived = [key for key in archivedKeys(downloadPath) if key not in known and not os.path.isfile(key)]
+    if len(files) == 0 and len(archived) == 0:
+        return
+
+    if dryRun:
+        activities = [parseFile(file)[0] for file in files]
+    else:
+        # indoor workouts have no positions but still match on distance and date
+        cache = TrackCache(os.path.join(cacheFolder, 'tracks'))
+        activities, failures = cache.loadAll(files, positioned=False)
+        cache.save()
+    if len(archived) > 0:
+        with TrackArchive(os.path.join(downloadPath, archiveName)) as archive:
+            activities += [archive.lookup(key) for key in archived]
+        files += archived
+
+    for file, activity in zip(files, activities):
+        if activity is None or activity.startTime is None:
+            continue
+        for iii in range(0, len(workouts)):
+            if workouts['ID'][iii] in manifest:
+                continue
+            if abs(workouts['Distance (km)'][iii] * 1000 - activity.distance) < 1 and \
+               abs((workouts['Date'][iii] - activity.startTime.date()).days) <= 1:
+                manifest[workouts['ID'][iii]] = TrackCache.key(file)
+                break
+
+# url of the tcx export for a workout link, optionally pointed at a different server
+def exportUrl(link, baseUrl=None):
+    url = link.replace('/workout', '/workout/export') + '/tcx'
+    if baseUrl:
+        url = re.sub(r'^https?://[^/]+', baseUrl.rstrip('/'), url)
+    return url
+
+# file name for a download, from the Content-Disposition header if the server sends one
+def downloadName(response, workout):
+    match = re.search(r'filename\*?=(?:UTF-8\'\')?"?([^";]+)"?', response.headers.get('Content-Disposition', ''))
+    name = urllib.parse.unquote(match.group(1)) if match else workout + '.tcx'
+    name = os.path.basename(name.replace('\\', '/')).strip()
+    if not name.endswith('.tcx'):
+        name += '.tcx'
+    return name
+
+# download one workout, returns the saved file path
+def fetchWorkout(session, workout, link, downloadPath, baseUrl=None):
+    response = session.get(exportUrl(link, baseUrl), timeout=timeout)
+    response.raise_for_status()
+    if tcxRoot not in response.content[:4096]:
+        raise ValueError('response is not a tcx file, check the cookie is still logged in')
+
+    # write to a temporary name first so a failed download never looks like a complete
+    # file. The temporary name is unique to the workout
+    partFile = os.path.join(downloadPath, workout + '.part')
+    with open(partFile, 'wb') as f:
+        f.write(response.content)
+
+    with nameLock:
+        fileName = os.path.join(downloadPath, downloadName(response, workout))
+        if os.path.exists(fileName):
+            # different workout with the same name, keep both
+            fileName = fileName.replace('.tcx', ' ' + workout + '.tcx')
+        os.replace(partFile, fileName)
+    return fileName
+
+# download every workout in the given years that does not have a tcx file yet,
+# each into data/<year>
+def sync(years, baseUrl=None, cookie=None, dryRun=False):
+    historyFiles = sorted(glob.glob(historyFilePattern))
+    summary = loadHistory(historyFiles)
+    summary['Year'] = summary['Date'].map(lambda d: d.year)
+    workouts = summary[summary['Year'].isin(years)].reset_index(drop=True)
+    print('Found ' + str(len(workouts)) + ' workouts in ' + ', '.join(str(y) for y in years) +
+          ' across ' + str(len(historyFiles)) + ' history files')
+
+    # drop manifest entries whose file has been removed so they are fetched again, unless
+    # the file was imported into its year's archive
+    manifest = loadManifest()
+    archived = set()
+    for year in years:
+        archived.update(archivedKeys(os.path.join(dataFolder, str(year))))
+    manifest = {key: value for key, value in manifest.items() if os.path.isfile(value) or value in archived}
+
+    # if data folders do not exist, make them. A dry run writes nothing, the folders,
+    # manifest and track cache are left as they are
+    for year in years:
+        downloadPath = os.path.join(dataFolder, str(year))
+        if not os.path.isdir(downloadPath):
+            if dryRun:
+                continue
+            os.makedirs(downloadPath)
+        matchExisting(workouts[workouts['Year'] == year].reset_index(drop=True), downloadPath, manifest, dryRun)
+    if not dryRun:
+        saveManifest(manifest)
+
+    missing = [iii for iii in range(0, len(workouts)) if workouts['ID'][iii] not in manifest]
+    print(str(len(workouts) - len(missing)) + ' already downloaded, ' + str(len(missing)) + ' to fetch')
+    if dryRun or len(missing) == 0:
+        for iii in missing:
+            print('Would fetch ' + workouts['ID'][iii] + ' from ' + workouts['Workout Date'][iii])
+        return
+
+    # requests is only needed once there is something to fetch, a dry run starts without it
+    import requests
+    import requests.adapters
+
+    # reuse connections across downloads, pool sized to the number of workers
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=connections, pool_maxsize=connections)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    if cookie:
+        session.headers['Cookie'] = cookie
+
+    failed = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=connections) as pool:
+        futures = {pool.submit(fetchWorkout, session, workouts['ID'][iii], workouts['Link'][iii],
+                               os.path.join(dataFolder, str(workouts['Year'][iii])), baseUrl): workouts['ID'][iii]
+                   for iii in missing}
+        for future in concurrent.futures.as_completed(futures):
+            workout = futures[future]
+            try:
+                fileName = future.result()
+            except (requests.RequestException, OSError, ValueError) as e:
+                print('Failed to fetch ' + workout + ' - ' + str(e))
+                failed += 1
+                continue
+            manifest[workout] = TrackCache.key(fileName)
+            print('Fetched ' + workout + ' to ' + fileName)
+
+    saveManifest(manifest)
+    print('Fetched ' + str(len(missing) - failed) + ' workouts, ' + str(failed) + ' failed')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Download tcx files for workouts in the MapMyRun history exports')
+    parser.add_argument('--years', type=int, nargs='+', default=years, help='years to download (default: %(default)s)')
+    parser.add_argument('--connections', type=int, default=connections,
+                        help='number of concurrent downloads (default: %(default)s)')
+    parser.add_argument('--base-url', default=None,
+                        help='fetch exports from this server instead of the one in the workout link, e.g. http://localhost:8000')
+    parser.add_argument('--cookie', default=os.environ.get('MAPMYRUN_COOKIE'),
+                        help='Cookie header of a logged in browser session (default: $MAPMYRUN_COOKIE)')
+    parser.add_argument('--dry-run', action='store_true', help='only list the workouts that would be fetched')
+    args = parser.parse_args()
+
+    connections = args.connections
+    sync(args.years, baseUrl=args.base_url, cookie=args.cookie, dryRun=args.dry_run)
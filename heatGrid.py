@@ -0,0 +1,46 @@
+import numpy as np
+
+##################################################################
+### Heat map binning
+##################################################################
+
+# web mercator tile size in pixels
+tileSize = 256
+
+
+# convert lat/lon in degrees to global web mercator pixel coordinates at a zoom level
+def mercatorPixels(latitude, longitude, zoom):
+    scale = tileSize * 2 ** zoom
+    lat = np.radians(np.clip(latitude, -85.05112878, 85.05112878))
+    x = (np.asarray(longitude) + 180) / 360 * scale
+    y = (1 - np.log(np.tan(lat) + 1 / np.cos(lat)) / np.pi) / 2 * scale
+    return x, y
+
+
+# bin points into square cells of cellSize screen pixels at the given zoom level.
+# returns an (n, 3) array of [lat, lon, weight] for the non-empty cells only, where
+# lat/lon is the mean position of the points in the cell and weight is the sum of
+# pointWeight over them. The size of the result depends on the area covered, not on
+# how many points were recorded.
+def binPoints(latitude, longitude, zoom, cellSize, pointWeight=1.0):
+    if len(latitude) == 0:
+        return np.zeros((0, 3))
+
+    x, y = mercatorPixels(latitude, longitude, zoom)
+    cellX = np.floor(x / cellSize).astype(np.int64)
+    cellY = np.floor(y / cellSize).astype(np.int64)
+
+    # single integer key per cell, x spans at most 2**(zoom + 8) pixels
+    key = cellY * (tileSize * 2 ** zoom // cellSize + 1) + cellX
+    cells, inverse = np.unique(key, return_inverse=True)
+
+    counts = np.bincount(inverse, minlength=len(cells))
+    lat = np.bincount(inverse, weights=latitude, minlength=len(cells)) / counts
+    lon = np.bincount(inverse, weights=longitude, minlength=len(cells)) / counts
+    return np.column_stack((lat, lon, counts * pointWeight))
+
+
+# bin points for a set of zoom levels, returns a list of (zoom, cells) pairs.
+# each grid is intended for display from its zoom level up to the next one
+def binZoomLevels(latitude, longitude, zooms, cellSize, pointWeight=1.0):
+    return [(zoom, binPoints(latitude, longitude, zoom, cellSize, pointWeight)) for zoom in zooms]
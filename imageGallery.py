@@ -0,0 +1,118 @@
+import os
+import hashlib
+import concurrent.futures
+from PIL import Image, ImageOps
+
+##################################################################
+### Gallery image variants
+##################################################################
+
+# longest edge in pixels and quality of each generated variant
+variantSizes = {'thumb': 160, 'display': 1600}
+variantQuality = {'thumb': 70, 'display': 80}
+
+# files in the picture folder with these extensions are put in the gallery, anything else
+# such as Thumbs.db or .DS_Store is ignored
+imageExtensions = ('.jpg', '.jpeg', '.png', '.webp', '.gif', '.bmp', '.tif', '.tiff')
+
+# bump when the variant settings change to regenerate all images
+galleryVersion = 1
+
+
+# hash of the source image content, used to name its variants so an unchanged
+# photo is never reprocessed even if it is renamed or touched
+def sourceHash(fileName):
+    digest = hashlib.sha1(str(galleryVersion).encode('utf-8'))
+    with open(fileName, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+# whether a file name looks like a picture
+def isImage(fileName):
+    return os.path.splitext(fileName)[1].lower() in imageExtensions
+
+
+# file name of a variant in the gallery folder
+def variantName(imageHash, variant):
+    return imageHash + '_' + variant + '.webp'
+
+
+# write the resized variants of one image, run in a worker process
+def makeVariants(fileName, imageHash, outFolder):
+    with Image.open(fileName) as image:
+        # phone photos are often stored sideways with an EXIF rotation flag
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGB')
+        for variant in variantSizes:
+            resized = image.copy()
+            resized.thumbnail((variantSizes[variant], variantSizes[variant]), Image.LANCZOS)
+            tmpFile = os.path.join(outFolder, variantName(imageHash, variant) + '.tmp')
+            resized.save(tmpFile, 'WEBP', quality=variantQuality[variant], method=4)
+            os.replace(tmpFile, os.path.join(outFolder, variantName(imageHash, variant)))
+    return fileName
+
+
+# make thumbnail and display variants of each picture, skipping any whose variants already
+# exist. Returns a list of dicts with the original, thumb and display paths for each picture.
+# Files that are not pictures are skipped, as are pictures that can't be read, with a message.
+# Variants that are no longer used by any picture are removed. hashes can map picture files
+# to their (size, mtime, hash) from an earlier call so unchanged pictures are not read again
+def buildGallery(pics, sourceFolder, outFolder, jobs=1, hashes=None):
+    if not os.path.isdir(outFolder):
+        os.makedirs(outFolder)
+
+    gallery = []
+    toProcess = []
+    for pic in pics:
+        fileName = os.path.join(sourceFolder, pic)
+        if not isImage(pic) or not os.path.isfile(fileName):
+            continue
+        if hashes is None:
+            imageHash = sourceHash(fileName)
+        else:
+            stat = os.stat(fileName)
+            known = hashes.get(fileName)
+            if known is not None and known[:2] == (stat.st_size, stat.st_mtime_ns):
+                imageHash = known[2]
+            else:
+                imageHash = sourceHash(fileName)
+                hashes[fileName] = (stat.st_size, stat.st_mtime_ns, imageHash)
+        entry = {'original': fileName.replace('\\', '/')}
+        for variant in variantSizes:
+            entry[variant] = os.path.join(outFolder, variantName(imageHash, variant)).replace('\\', '/')
+        gallery.append(entry)
+        if not all(os.path.isfile(entry[variant]) for variant in variantSizes):
+            toProcess.append((fileName, imageHash))
+
+    if len(toProcess) > 0:
+        print('Resizing ' + str(len(toProcess)) + ' of ' + str(len(gallery)) + ' pictures')
+        failed = set()
+        if jobs > 1 and len(toProcess) > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=min(jobs, len(toProcess))) as pool:
+                futures = {pool.submit(makeVariants, fileName, imageHash, outFolder): fileName
+                           for fileName, imageHash in toProcess}
+                for future in concurrent.futures.as_completed(futures):
+                    try:
+                        print('Resized ' + future.result())
+                    except OSError as e:
+                        print('Skipped ' + futures[future] + ' - ' + str(e))
+                        failed.add(futures[future])
+        else:
+            for fileName, imageHash in toProcess:
+                try:
+                    print('Resized ' + makeVariants(fileName, imageHash, outFolder))
+                except OSError as e:
+                    print('Skipped ' + fileName + ' - ' + str(e))
+                    failed.add(fileName)
+        failed = set(fileName.replace('\\', '/') for fileName in failed)
+        gallery = [entry for entry in gallery if entry['original'] not in failed]
+
+    # drop variants of pictures that have been removed or changed
+    used = set(os.path.basename(entry[variant]) for entry in gallery for variant in variantSizes)
+    for file in os.listdir(outFolder):
+        if file.endswith('.webp') and file not in used:
+            os.remove(os.path.join(outFolder, file))
+
+    return gallery
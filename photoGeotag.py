@@ -0,0 +1,103 @@
+import re
+import datetime
+import numpy as np
+from PIL import Image
+from trackStats import packActivities
+
+##################################################################
+### Photo positions from track times
+##################################################################
+
+# a photo taken this close to the start or end of a walk is placed at that end of the track
+photoTolerance = 300 # s
+
+# EXIF tags holding the capture time and its UTC offset
+exifIfd = 0x8769
+exifDateTimeOriginal = 36867
+exifOffsetTimeOriginal = 36881
+
+
+# capture time of a photo in epoch seconds, None if it cannot be found.
+# Pixel phones name photos by their UTC capture time, e.g. PXL_20240328_094044949.jpg.
+# Otherwise the EXIF capture time is used, but only if it records its UTC offset as a
+# local time on its own could be hours out
+def photoTime(fileName):
+    match = re.search(r'PXL_(\d{8})_(\d{6})', fileName)
+    if match:
+        time = datetime.datetime.strptime(match.group(1) + match.group(2), '%Y%m%d%H%M%S')
+        return time.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+    try:
+        with Image.open(fileName) as image:
+            exif = image.getexif().get_ifd(exifIfd)
+    except OSError:
+        return None
+    taken = exif.get(exifDateTimeOriginal)
+    offset = exif.get(exifOffsetTimeOriginal)
+    if not taken or not offset:
+        return None
+    try:
+        time = datetime.datetime.strptime(taken.strip('\x00 ') + offset.strip('\x00 '), '%Y:%m:%d %H:%M:%S%z')
+    except ValueError:
+        return None
+    return time.timestamp()
+
+
+# position of each photo on the tracks from its capture time. Points of all activities are
+# sorted into one time index and each photo is found with a binary search, then placed
+# between the points either side of it if they are from the same activity, or at the
+# nearest point if that is within photoTolerance.
+# Only activities within photoTolerance of a photo's time are searched, so the cost follows
+# the walks the photos were taken on rather than the size of the archive.
+# Returns latitude, longitude and activity index arrays, NaN and -1 for photos not on a track
+def locatePhotos(activities, times):
+    times = np.array([np.nan if time is None else time for time in times], dtype=np.float64)
+    latitude = np.full(len(times), np.nan)
+    longitude = np.full(len(times), np.nan)
+    activity = np.full(len(times), -1, dtype=np.int64)
+
+    sortedTimes = np.sort(times[np.isfinite(times)])
+    starts = np.array([a.time[0] if len(a) > 0 else np.nan for a in activities], dtype=np.float64)
+    ends = np.array([a.time[-1] if len(a) > 0 else np.nan for a in activities], dtype=np.float64)
+    with np.errstate(invalid='ignore'):
+        photosInSpan = (np.searchsorted(sortedTimes, ends + photoTolerance, side='right') -
+                        np.searchsorted(sortedTimes, starts - photoTolerance, side='left'))
+    candidates = np.flatnonzero(np.isfinite(starts) & (photosInSpan > 0))
+
+    offsets, activityIndex, columns = packActivities([activities[iii] for iii in candidates])
+    activityIndex = candidates[activityIndex]
+    order = np.argsort(columns['time'], kind='stable')
+    pointTime = columns['time'][order]
+    pointLatitude = columns['latitude'][order]
+    pointLongitude = columns['longitude'][order]
+    pointActivity = activityIndex[order]
+    if len(pointTime) == 0:
+        return latitude, longitude, activity
+
+    known = np.flatnonzero(np.isfinite(times))
+    t = times[known]
+    after = np.searchsorted(pointTime, t, side='right')
+    before = np.clip(after - 1, 0, len(pointTime) - 1)
+    after = np.clip(after, 0, len(pointTime) - 1)
+
+    # between two points of the same activity - interpolate
+    between = (pointTime[before] <= t) & (t <= pointTime[after]) & (pointActivity[before] == pointActivity[after])
+    span = pointTime[after] - pointTime[before]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fraction = np.where(span > 0, (t - pointTime[before]) / span, 0)
+    lat = pointLatitude[before] + fraction * (pointLatitude[after] - pointLatitude[before])
+    lon = pointLongitude[before] + fraction * (pointLongitude[after] - pointLongitude[before])
+    act = pointActivity[before]
+
+    # otherwise snap to the nearest point in time
+    nearest = np.where(np.abs(t - pointTime[before]) <= np.abs(pointTime[after] - t), before, after)
+    near = ~between & (np.abs(pointTime[nearest] - t) <= photoTolerance)
+    lat = np.where(near, pointLatitude[nearest], lat)
+    lon = np.where(near, pointLongitude[nearest], lon)
+    act = np.where(near, pointActivity[nearest], act)
+
+    placed = between | near
+    latitude[known[placed]] = lat[placed]
+    longitude[known[placed]] = lon[placed]
+    activity[known[placed]] = act[placed]
+    return latitude, longitude, activity
@@ -1,14 +1,24 @@
 import os
-from tcxreader.tcxreader import TCXReader
-import folium
-import folium.plugins
+import re
+import json
+import time
+import argparse
+import cProfile
+import numpy as np
+from trackCache import TrackCache
+from trackSimplify import simplifyTrack
+from heatGrid import binZoomLevels
+from trackExport import writeSidecar, trackCollection
+from trackStats import computeStats, sustainedDistance
+from activityTable import buildActivityTable, aggregate
+from trackIndex import TrackIndex, activityId, cellCentres, cellSize
+from trackArchive import TrackArchive, archiveName
+import stageProfile
+from stageProfile import Stage
 import math
-from branca.element import Template
 
-# import bokeh items
-import bokeh.models as models
-import bokeh.plotting as plotting
-import bokeh.embed as embed
+# folium, branca and bokeh are slow to import, so they are imported by the functions that
+# draw the map and plots. Loading tracks and the stats command of walks.py don't need them
 
 ##################################################################
 ### PROCESSING AND PATH PARAMETERS
@@ -18,173 +28,386 @@ import bokeh.embed as embed
 # base data folder
 dataFolder = 'data'
 
-# year to plot
+# folder for parsed track cache - delete to force a full re-parse
+cacheFolder = 'cache'
+
+# year shown on index.html, other years are written to walks<year>.html
 year = 2024
 
-# find all data files
-dataFiles = []
-for file in os.listdir(os.path.join(dataFolder, str(year))):
-    dataFiles.append(os.path.join(dataFolder, str(year), file))
+# page with every year on it
+allTimeFile = 'all.html'
 
 # specify how many tracks to include
 #endIndex = 10 # for testing, only use first
-endIndex = len(dataFiles) # all tracks
+endIndex = None # all tracks
+
+# heat map mode - 'grid' bins all points into weighted cells before writing the page,
+# 'points' writes the downsampled raw points for leaflet to bin in the browser
+heatMapMode = 'grid'
 
-# heat map downsample rate - reduce number of points to reduce file size
+# heat map downsample rate - reduce number of points to reduce file size ('points' mode).
+# in 'grid' mode each point has weight 1/hmDownsample so the heat intensity matches
 hmDownsample = 10
-trackDownsample = 2
+
+# heat map grid - one grid is built per zoom level and shown until the next level
+hmZooms = [5, 8, 11, 14]
+hmCellSize = 4 # px
+
+# track simplification tolerance - points closer than this to the simplified line are dropped
+simplifyTolerance = 3 # m
+
+# how tracks are written to the map
+#   'layer'   - all tracks in one geojson layer written into the page, with shared hover handlers
+#   'inline'  - one PolyLine per track written into the page, each with its own handlers
+#   'sidecar' - as 'layer', but tracks are written to geojson files in trackFolder/<year> that
+#               the map fetches as they come into view. The page must be served over http for this
+trackMode = 'layer'
+trackFolder = 'tracks'
+
+# draw the 'layer' and 'sidecar' tracks on a canvas rather than as one svg path each
+trackCanvas = True
+
+# sidecar chunk size in degrees, tracks are grouped by the centre of their bounds
+trackChunkSize = 0.5
+# sidecar tracks are only fetched once the map is zoomed in this far, 0 loads all visible tracks
+trackMinZoom = 0
 
 # map display parameters
 mapHeight = 600 # px
 mapWidth = 1200 # px
 popupMaxWidth = 400 # px
 
+# pictures for the gallery and the folder their resized copies are written to
+imageFolder = 'images'
+galleryFolder = 'gallery'
+
+# size of the picture thumbnails on the map
+photoIconSize = 48 # px
+
+# watch mode - how often the data and image folders are checked for changes, and how
+# long they must stay unchanged before rebuilding
+watchInterval = 1 # s
+watchSettle = 0.5 # s
+
 # plot display paramters
 plotHeight = 600
 plotWidth = 1200
 
+# page template, looked up next to this script so the build can run from any folder
+templateFolder = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+pageTemplate = 'page.html'
+
 ##################################################################
 ### Load and process data
 ##################################################################
 
-# load in data
-reader = TCXReader()
-dataSets = []
-for iii in range(0, endIndex):
-    print('Loading track ' + str(iii) + ' of ' + str(len(dataFiles)))
-    dataSets.append(reader.read(dataFiles[iii]))
-    
-# create list of data points
-hmData = []
-tracks = []
-infos = []
-dates = []
-distances = []
-for iii in range(0, endIndex):
-    print('Merging track ' + str(iii) + ' of ' + str(len(dataSets)))
-    
-    # extract track data points
-    track = []
-    for point in dataSets[iii].trackpoints:
-        track.append([point.latitude, point.longitude])
+# years with a folder in the data folder
+def findYears():
+    return sorted(int(folder) for folder in os.listdir(dataFolder)
+                  if folder.isdigit() and os.path.isdir(os.path.join(dataFolder, folder)))
+
+# page file for a year
+def pageFile(pageYear):
+    if pageYear == year:
+        return 'index.html'
+    return 'walks' + str(pageYear) + '.html'
+
+# year a picture was taken from the date in file names like PXL_20240328_094044949.jpg,
+# None if the name has no date
+def imageYear(fileName):
+    match = re.search(r'(?<!\d)(20\d{2})(0[1-9]|1[0-2])([0-2]\d|3[01])', fileName)
+    return int(match.group(1)) if match else None
+
+# find all data files, sorted so the page is built in the same order on every run
+def findDataFiles(year):
+    dataFiles = []
+    for file in sorted(os.listdir(os.path.join(dataFolder, str(year)))):
+        if os.path.splitext(file)[1] != '.tcx':
+            continue
+        dataFiles.append(os.path.join(dataFolder, str(year), file))
+    return dataFiles[:endIndex]
+
+# activities only kept in the year's archive, their tcx files having been removed after
+# trackArchive.py imported them. Returns the track id of each source file, the ids change
+# whenever the archive is written again
+def findArchived(year, dataFiles):
+    archiveFile = os.path.join(dataFolder, str(year), archiveName)
+    if not os.path.isfile(archiveFile):
+        return {}
+    present = set(TrackCache.key(file) for file in dataFiles)
+    size, mtime = TrackCache.signature(archiveFile)
+    with TrackArchive(archiveFile) as archive:
+        return {key: key + '@' + archiveName + '-' + str(size) + '-' + str(mtime)
+                for key in archive.keys if key not in present}
+
+# read activities found by findArchived. Each archive is opened once and only the records
+# of the requested files are decoded
+def loadArchived(files):
+    archives = {}
+    dataSets = []
+    try:
+        for file in files:
+            archiveFile = os.path.join(os.path.dirname(file), archiveName)
+            if archiveFile not in archives:
+                archives[archiveFile] = TrackArchive(archiveFile)
+            dataSets.append(archives[archiveFile].lookup(file))
+    finally:
+        for archive in archives.values():
+            archive.close()
+    print('Read ' + str(len(files)) + ' tracks from archives')
+    return dataSets
+
+# load in data - only positioned points are kept, as numpy arrays.
+# tracks are only parsed if new or changed since the last run, using up to jobs processes.
+# files that fail to parse are reported and left out rather than stopping the build.
+# Returns the tracks and the files they came from. An open cache can be passed in to
+# reuse it across loads
+def loadTracks(dataFiles, jobs=1, cache=None):
+    if cache is None:
+        cache = TrackCache(os.path.join(cacheFolder, 'tracks'))
+    hits, misses = cache.hits, cache.misses
+    cache.parseTimes.clear()
+    loaded, failures = cache.loadAll(dataFiles, jobs=jobs)
+    cache.evictMissing()
+    cache.save()
+    parseFailures = len([file for file in failures if file in cache.parseTimes])
+    print('Parsed ' + str(cache.misses - misses - parseFailures) + ' tracks, ' +
+          str(cache.hits - hits - (len(failures) - parseFailures)) + ' loaded from cache')
+
+    for file in failures:
+        print('Failed to load ' + file + ' - ' + failures[file])
+
+    for iii in range(0, len(dataFiles)):
+        if dataFiles[iii] in cache.parseTimes and loaded[iii] is not None:
+            stageProfile.recordFile(dataFiles[iii], cache.parseTimes[dataFiles[iii]], len(loaded[iii]))
+
+    loadedFiles = [dataFiles[iii] for iii in range(0, len(dataFiles)) if loaded[iii] is not None]
+    return [dataSet for dataSet in loaded if dataSet is not None], loadedFiles
+
+# tcx files and archived activities of the given years with their track ids, and the set
+# of those that are read from an archive rather than parsed
+def findTracks(years):
+    dataFiles = []
+    ids = []
+    archived = set()
+    for buildYear in years:
+        yearFiles = findDataFiles(buildYear)
+        yearArchived = findArchived(buildYear, yearFiles)
+        dataFiles += yearFiles + list(yearArchived)
+        ids += [activityId(file) for file in yearFiles] + list(yearArchived.values())
+        archived.update(yearArchived)
+    return dataFiles, ids, archived
+
+# load tracks found by findTracks, parsing the tcx files and reading the archived ones.
+# Returns the tracks and the files they came from, as loadTracks does
+def loadAllTracks(dataFiles, archived, jobs=1, cache=None):
+    toParse = [file for file in dataFiles if file not in archived]
+    dataSets, loadedFiles = loadTracks(toParse, jobs=jobs, cache=cache) if toParse else ([], [])
+    fromArchive = [file for file in dataFiles if file in archived]
+    if len(fromArchive) > 0:
+        dataSets += loadArchived(fromArchive)
+        loadedFiles += fromArchive
+    return dataSets, loadedFiles
+
+# grid index of the cells each track passes through, saved with the track cache so
+# only new or changed tracks are binned on the next run
+def indexTracks(dataSets, files):
+    indexFile = os.path.join(cacheFolder, 'index.npz')
+    index = TrackIndex.load(indexFile)
+    if index.update([activityId(file) for file in files], dataSets):
+        index.save(indexFile)
+    print('Indexed ' + str(len(dataSets)) + ' tracks over ' + str(len(index.coveredCells())) + ' grid cells')
+    return index
+
+# format a time in seconds as 1h:02m
+def formatHours(seconds):
+    hours = math.floor(seconds/60/60)
+    minutes = math.floor((seconds - hours * 60 * 60) / 60)
+    return str(hours) + 'h:' + str(minutes).zfill(2) + 'm'
+
+# create list of data points. merged can map track ids to what an earlier call worked out
+# for each track - its points, simplified points, popup text and stats - so only new tracks
+# are simplified and have their stats computed, and is filled in with the new ones
+def mergeTracks(dataSets, ids=None, merged=None):
+    if ids is None:
+        ids = list(range(0, len(dataSets)))
+    if merged is None:
+        merged = {}
+
+    # statistics for all new tracks at once from the point arrays
+    new = [iii for iii in range(0, len(dataSets)) if ids[iii] not in merged]
+    newStats = computeStats([dataSets[iii] for iii in new])
+    for position, iii in enumerate(new):
+        stats = {key: newStats[key][position] for key in newStats}
+
+        # extract track data points, the full track is kept for the heat map
+        track = np.column_stack((dataSets[iii].latitude, dataSets[iii].longitude))
+        # store simplified track for individual plotting
+        keep = simplifyTrack(dataSets[iii].latitude, dataSets[iii].longitude, simplifyTolerance)
+        print('Merging track ' + str(iii) + ' of ' + str(len(dataSets)) + ' - ' + dataSets[iii].name +
+              ': ' + str(len(track)) + ' points in, ' + str(len(keep)) + ' points out')
+
+        # cross check the recorded distance against the distance between the points
+        if abs(stats['haversineDistance'] - dataSets[iii].distance) > 0.1 * dataSets[iii].distance:
+            print('Warning: ' + dataSets[iii].name + ' records ' + str(round(dataSets[iii].distance/1000, 2)) +
+                  'km but its points cover ' + str(round(stats['haversineDistance']/1000, 2)) + 'km')
         
-    # append to to full list (in downsampled format) for heat map
-    hmData += track[0::hmDownsample]
-    # store track for individual plotting
-    tracks.append(track[0::trackDownsample])
-    
-    # track dates and distances
-    dates.append(dataSets[iii].start_time)
-    distances.append(dataSets[iii].distance/1000)
-    
-    # extract info
-    text = 'Description: ' + os.path.basename(dataFiles[iii]).replace('.tcx', '') + '<br>'
-    text += 'Date: ' + dataSets[iii].start_time.strftime('%d-%b-%Y') + '<br>'
-    text += 'Distance: ' + str(round(dataSets[iii].distance/1000, 2)) + 'km<br>'
-    hours = math.floor(dataSets[iii].duration/60/60)
-    minutes = math.floor((dataSets[iii].duration - hours * 60 * 60) / 60)
-    seconds = round(dataSets[iii].duration - hours * 60 * 60 - minutes * 60, 1)
-    text += 'Duration: ' + str(hours) + 'h:' + str(minutes) + 'm:' + str(seconds) + 's<br>'
-    text += 'Average Speed: ' + str(round(dataSets[iii].distance/1000 / (dataSets[iii].duration/60/60), 2)) + 'kmph'
-    infos.append(text)
-
-# post process distances for plotting
-months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-monthDist = [0 for m in months]
-weeks = list(range(1, 53))
-weekDist = [0 for w in weeks]
-
-for iii in range(0, len(dates)):
-    month = dates[iii].month
-    week = dates[iii].isocalendar().week
-    
-    # add to month and week distance trackers
-    monthDist[month - 1] += distances[iii]
-    weekDist[week - 1] += distances[iii]
-
-# calculate cumulative distances
-monthCumulative = [monthDist[0]]
-for iii in range(1, len(months)):
-    monthCumulative.append(monthCumulative[-1] + monthDist[iii])
-weekCumulative = [weekDist[0]]
-for iii in range(1, len(weeks)):
-    weekCumulative.append(weekCumulative[-1] + weekDist[iii])
+        # extract info
+        text = 'Description: ' + dataSets[iii].name + '<br>'
+        text += 'Date: ' + dataSets[iii].startTime.strftime('%d-%b-%Y') + '<br>'
+        text += 'Distance: ' + str(round(dataSets[iii].distance/1000, 2)) + 'km<br>'
+        hours = math.floor(dataSets[iii].duration/60/60)
+        minutes = math.floor((dataSets[iii].duration - hours * 60 * 60) / 60)
+        seconds = round(dataSets[iii].duration - hours * 60 * 60 - minutes * 60, 1)
+        text += 'Duration: ' + str(hours) + 'h:' + str(minutes) + 'm:' + str(seconds) + 's<br>'
+        if dataSets[iii].duration > 0:
+            text += 'Average Speed: ' + str(round(dataSets[iii].distance/1000 / (dataSets[iii].duration/60/60), 2)) + 'kmph<br>'
+        text += 'Moving Time: ' + formatHours(stats['movingTime']) + \
+                ' (stopped ' + formatHours(stats['stoppedTime']) + ')<br>'
+        text += 'Elevation: +' + str(round(stats['elevationGain'])) + 'm/-' + str(round(stats['elevationLoss'])) + 'm'
+        if not np.isnan(stats['bestPace']):
+            paceMinutes = math.floor(stats['bestPace'])
+            paceSeconds = round((stats['bestPace'] - paceMinutes) * 60)
+            text += '<br>Best ' + str(round(sustainedDistance/1000, 1)) + 'km Pace: ' + \
+                    str(paceMinutes) + ':' + str(paceSeconds).zfill(2) + 'min/km'
+
+        merged[ids[iii]] = (track, track[keep], text, stats)
+
+    hmData = [merged[id][0] for id in ids]
+    tracks = [merged[id][1] for id in ids]
+    infos = [merged[id][2] for id in ids]
+    stats = {key: np.array([merged[id][3][key] for id in ids], dtype=np.float64) for key in newStats}
+    print('Simplified tracks from ' + str(sum(len(track) for track in hmData)) + ' to ' +
+          str(sum(len(track) for track in tracks)) + ' points')
+
+    return hmData, tracks, infos, stats
+
+# post process distances for plotting - activity summaries are held in one table and
+# totalled per month and per ISO week of the year, returns the data for the plots
+def aggregateDistances(table, year):
+    monthData = aggregate(table, 'month', str(year) + '-01-01', str(year) + '-12-31')
+    weekData = aggregate(table, 'week', str(year) + '-01-01', str(year) + '-12-31')
+    return monthData, weekData
     
 ##################################################################
 ### Create plots
 ##################################################################
 
-# create monthly plot
-dataDict = {'month' : months,
-            'distance' : monthDist,
-            'cumulative' : monthCumulative,
-            }
-source = models.ColumnDataSource(data = dataDict)
-
-monthPlot = plotting.figure(x_range=models.FactorRange(*months), height=plotHeight, 
-                            width=plotWidth, tools="hover", 
-                            tooltips=[('Month', '@month'),
-                                      ('Month Distance', '@distance'),
-                                      ('Cumulative', '@cumulative'),
-                                      ],
-                            title = 'Monthly Plot',
-                            x_axis_label="Month",
-                            y_axis_label="Distance (km)",
-                            )
-
-b = monthPlot.vbar(x="month", top="distance", source=source, width=0.8,
-                   line_color=None, legend_label='Monthly Distance')
-monthPlot.y_range.renderers = [b]
-monthPlot.extra_y_ranges = {"yCum": models.DataRange1d()}
-monthPlot.add_layout(models.LinearAxis(y_range_name="yCum", axis_label='Cumulative Distance (km)'), 'right')
-monthPlot.line(x="month", y="cumulative", source=source, color='black', line_width=2,
-               legend_label='Cumulative Distance', y_range_name="yCum")
-monthPlot.scatter(x="month", y="cumulative", source=source, size=5, fill_color = "black",
-                  line_color="black", legend_label='Cumulative Distance', y_range_name="yCum")
-monthPlot.add_layout(monthPlot.legend[0], 'right')
-
-# create weekly plot
-dataDict = {'week' : weeks,
-            'distance' : weekDist,
-            'cumulative' : weekCumulative,
-            }
-source = models.ColumnDataSource(data = dataDict)
-
-weekPlot = plotting.figure(height=plotHeight, 
-                            width=plotWidth, tools="hover", 
-                            tooltips=[('Week', '@week'),
-                                      ('Week Distance', '@distance'),
-                                      ('Cumulative', '@cumulative'),
-                                      ],
-                            title = 'Weekly Plot',
-                            x_axis_label="Week Number",
-                            y_axis_label="Distance (km)",
-                            )
-
-b = weekPlot.vbar(x="week", top="distance", source=source, width=0.8,
-                  line_color=None, legend_label='Weekly Distance')
-weekPlot.y_range.renderers = [b]
-weekPlot.extra_y_ranges = {"yCum": models.DataRange1d()}
-weekPlot.add_layout(models.LinearAxis(y_range_name="yCum", axis_label='Cumulative Distance (km)'), 'right')
-weekPlot.line(x="week", y="cumulative", source=source, color='black', line_width=2,
-               legend_label='Cumulative Distance', y_range_name="yCum")
-weekPlot.scatter(x="week", y="cumulative", source=source, size=5, fill_color = "black",
-                  line_color="black", legend_label='Cumulative Distance', y_range_name="yCum")
-weekPlot.add_layout(weekPlot.legend[0], 'right')
+def createPlots(monthData, weekData):
+    import bokeh.models as models
+    import bokeh.plotting as plotting
+
+    # create monthly plot
+    source = models.ColumnDataSource(data = monthData)
+
+    monthPlot = plotting.figure(x_range=models.FactorRange(*monthData['label']), height=plotHeight, 
+                                width=plotWidth, tools="hover", 
+                                tooltips=[('Month', '@label'),
+                                          ('Month Distance', '@distance'),
+                                          ('Cumulative', '@cumulative'),
+                                          ('Elevation Gain (m)', '@climb{0}'),
+                                          ('Moving Time (h)', '@moving{0.0}'),
+                                          ],
+                                title = 'Monthly Plot',
+                                x_axis_label="Month",
+                                y_axis_label="Distance (km)",
+                                )
+
+    b = monthPlot.vbar(x="label", top="distance", source=source, width=0.8,
+                       line_color=None, legend_label='Monthly Distance')
+    monthPlot.y_range.renderers = [b]
+    monthPlot.extra_y_ranges = {"yCum": models.DataRange1d()}
+    monthPlot.add_layout(models.LinearAxis(y_range_name="yCum", axis_label='Cumulative Distance (km)'), 'right')
+    monthPlot.line(x="label", y="cumulative", source=source, color='black', line_width=2,
+                   legend_label='Cumulative Distance', y_range_name="yCum")
+    monthPlot.scatter(x="label", y="cumulative", source=source, size=5, fill_color = "black",
+                      line_color="black", legend_label='Cumulative Distance', y_range_name="yCum")
+    monthPlot.add_layout(monthPlot.legend[0], 'right')
+
+    # create weekly plot
+    source = models.ColumnDataSource(data = weekData)
+
+    weekPlot = plotting.figure(height=plotHeight, 
+                                width=plotWidth, tools="hover", 
+                                x_axis_type="datetime",
+                                tooltips=[('Week', '@label'),
+                                          ('Week Distance', '@distance'),
+                                          ('Cumulative', '@cumulative'),
+                                          ('Elevation Gain (m)', '@climb{0}'),
+                                          ('Moving Time (h)', '@moving{0.0}'),
+                                          ],
+                                title = 'Weekly Plot',
+                                x_axis_label="Week Starting",
+                                y_axis_label="Distance (km)",
+                                )
+
+    # weeks are plotted by their start date so the ISO week 1 that ends the year sits after week 52
+    b = weekPlot.vbar(x="start", top="distance", source=source, width=0.8*7*24*60*60*1000,
+                      line_color=None, legend_label='Weekly Distance')
+    weekPlot.y_range.renderers = [b]
+    weekPlot.extra_y_ranges = {"yCum": models.DataRange1d()}
+    weekPlot.add_layout(models.LinearAxis(y_range_name="yCum", axis_label='Cumulative Distance (km)'), 'right')
+    weekPlot.line(x="start", y="cumulative", source=source, color='black', line_width=2,
+                   legend_label='Cumulative Distance', y_range_name="yCum")
+    weekPlot.scatter(x="start", y="cumulative", source=source, size=5, fill_color = "black",
+                      line_color="black", legend_label='Cumulative Distance', y_range_name="yCum")
+    weekPlot.add_layout(weekPlot.legend[0], 'right')
+
+    return [('monthPlot', monthPlot), ('weekPlot', weekPlot)]
+
+# plots for the all time page - totals per year, and the running total through each year.
+# clicking a year in the legend hides it
+def createAllTimePlots(table, years):
+    import bokeh.models as models
+    import bokeh.plotting as plotting
+    from bokeh.palettes import Category10
+
+    yearData = aggregate(table, 'year', str(years[0]) + '-01-01', str(years[-1]) + '-12-31')
+    source = models.ColumnDataSource(data = yearData)
+
+    yearPlot = plotting.figure(x_range=models.FactorRange(*yearData['label']), height=plotHeight, 
+                               width=plotWidth, tools="hover", 
+                               tooltips=[('Year', '@label'),
+                                         ('Year Distance', '@distance'),
+                                         ('Elevation Gain (m)', '@climb{0}'),
+                                         ('Moving Time (h)', '@moving{0.0}'),
+                                         ],
+                               title = 'Yearly Plot',
+                               x_axis_label="Year",
+                               y_axis_label="Distance (km)",
+                               )
+    yearPlot.vbar(x="label", top="distance", source=source, width=0.8, line_color=None)
+
+    months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+    monthPlot = plotting.figure(x_range=models.FactorRange(*months), height=plotHeight, 
+                                width=plotWidth, tools="hover", 
+                                tooltips=[('Year', '@year'),
+                                          ('Month', '@label'),
+                                          ('Month Distance', '@distance'),
+                                          ('Cumulative', '@cumulative'),
+                                          ],
+                                title = 'Cumulative Distance by Year',
+                                x_axis_label="Month",
+                                y_axis_label="Cumulative Distance (km)",
+                                )
+    for iii in range(0, len(years)):
+        monthData = aggregate(table, 'month', str(years[iii]) + '-01-01', str(years[iii]) + '-12-31')
+        monthData['year'] = str(years[iii])
+        source = models.ColumnDataSource(data = monthData)
+        color = Category10[10][iii % 10]
+        monthPlot.line(x="label", y="cumulative", source=source, color=color, line_width=2,
+                       legend_label=str(years[iii]))
+        monthPlot.scatter(x="label", y="cumulative", source=source, size=5, fill_color=color,
+                          line_color=color, legend_label=str(years[iii]))
+    monthPlot.legend.click_policy = 'hide'
+    monthPlot.add_layout(monthPlot.legend[0], 'right')
+
+    return [('yearPlot', yearPlot), ('monthPlot', monthPlot)]
 
 ##################################################################
 ### Create map
 ##################################################################
 
-# create map view of all walks
-m = folium.Map([48.0, 5.0], zoom_start=6)
-
-# heat map based on all data
-folium.plugins.HeatMap(hmData, name="Heat Map",
-                       min_opacity = 0.5,
-                       radius = 15,
-                       ).add_to(m)
-
 # Edit ployline behaviour to change color on hover
 templateText = \
 """
@@ -244,118 +467,289 @@ templateText = \
             {% endmacro %}
 """
 
-trackGroup = folium.FeatureGroup(name="Tracks").add_to(m)
-for iii in range(0, len(tracks)):
-    track = tracks[iii]
-    
-    # create line object
-    line = folium.PolyLine(
-        locations=track,
-        color="black",
-        weight=2,
-        tooltip=infos[iii],
-        popup=folium.Popup(infos[iii], max_width=popupMaxWidth),
-    )
-    # update template to add hover behaviour
-    line._template = Template(templateText)
-    
-    # add line to track group - this will show as single item in legend
-    line.add_to(trackGroup)
+# show the pre-binned heat map for the current zoom level
+heatSwitchTemplateText = \
+"""
+            {% macro script(this, kwargs) %}
+                var {{ this.get_name() }} = [
+                    {% for zoom, heat in this.bands %}
+                    [{{ zoom }}, {{ heat.get_name() }}],
+                    {% endfor %}
+                ];
 
-# add legend and layer selection
-folium.LayerControl().add_to(m)
+                function {{ this.get_name() }}_update() {
+                    var zoom = {{ this._parent.get_name() }}.getZoom();
+                    var bands = {{ this.get_name() }};
+                    for (var i = 0; i < bands.length; i++) {
+                        var show = (i == 0 || zoom >= bands[i][0]) &&
+                                   (i == bands.length - 1 || zoom < bands[i + 1][0]);
+                        if (show && !{{ this.group.get_name() }}.hasLayer(bands[i][1])) {
+                            {{ this.group.get_name() }}.addLayer(bands[i][1]);
+                        } else if (!show && {{ this.group.get_name() }}.hasLayer(bands[i][1])) {
+                            {{ this.group.get_name() }}.removeLayer(bands[i][1]);
+                        }
+                    }
+                }
 
-# fit map to data, this adjusts default zoom
-m.fit_bounds(m.get_bounds(), padding=(30, 30))
+                {{ this._parent.get_name() }}.on('zoomend', {{ this.get_name() }}_update);
+                {{ this.get_name() }}_update();
+            {% endmacro %}
+"""
 
-##################################################################
-### Create HTML Doc
-##################################################################
+# heat map from cells already serialised by createMapLayers, in place of the folium HeatMap
+# template that serialises its data on every render
+heatLayerTemplateText = \
+"""
+            {% macro script(this, kwargs) %}
+                var {{ this.get_name() }} = L.heatLayer(
+                    {{ this.data_text }},
+                    {{ this.options|tojson }}
+                );
+            {% endmacro %}
+"""
 
-# set map to display in an iframe with set width and height
-m.get_root().width = str(mapWidth) + "px"
-m.get_root().height = str(mapHeight) + "px"
-iframe = m.get_root()._repr_html_()
+# all tracks in a single geojson layer, either embedded or loaded in chunks as they come into
+# view. Hover and popup events from each track bubble up to the layer, so one set of handlers
+# covers every track. Popup and tooltip text come from the feature properties
+trackLayerTemplateText = \
+"""
+            {% macro script(this, kwargs) %}
+                var {{ this.get_name() }} = L.geoJSON(null, {
+                    {% if this.canvas %}
+                    renderer: L.canvas({tolerance: 3}),
+                    {% endif %}
+                    style: {color: 'black', opacity: 1, weight: 2},
+                    onEachFeature: function(feature, layer) {
+                        layer.bindTooltip(feature.properties.info);
+                        layer.bindPopup(feature.properties.info, {maxWidth: {{ this.popup_max_width }}});
+                    }
+                });
 
-# prepare for embedding bokeh plots
-plotDict = {'monthPlot' : monthPlot,
-            'weekPlot' : weekPlot,
-            }
-            
-script, divs = embed.components(plotDict)
-
-# generate image code and tag
-pics = os.listdir('images')
-imgTag = '<div class="galcontainer">\n\t<img id="image" src="images/' + pics[0] + '" alt="image"style="max-height:500px; max-width:100%; width:auto; height:auto;">\n'
-imgTag += """\t<!-- Next and previous buttons -->
-\t<a class="prev" onclick="showImg(-1)">&#10094;</a>
-\t<a class="next" onclick="showImg(1)">&#10095;</a>\n
-</div>
+                function {{ this.get_name() }}_highlight(e) {
+                    e.layer.setStyle({
+                        color: 'magenta',
+                        opacity: 1,
+                        weight: 2
+                    });
+
+                    e.layer.bringToFront();
+                }
+
+                function {{ this.get_name() }}_reset(e) {
+                    e.layer.setStyle({
+                        color: 'black',
+                        opacity: 1,
+                        weight: 2
+                    });
+                }
+
+                {{ this.get_name() }}.on('mouseover', {{ this.get_name() }}_highlight);
+                {{ this.get_name() }}.on('popupopen', {{ this.get_name() }}_highlight);
+                {{ this.get_name() }}.on('mouseout', function(e) {
+                    if (!e.layer.isPopupOpen()){
+                        {{ this.get_name() }}_reset(e);
+                    }
+                });
+                {{ this.get_name() }}.on('popupclose', {{ this.get_name() }}_reset);
+
+                {{ this.get_name() }}.addTo({{ this.group.get_name() }});
+
+                {% if this.chunks is none %}
+                {{ this.get_name() }}.addData({{ this.data }});
+                {% else %}
+                var {{ this.get_name() }}_chunks = {{ this.chunks|tojson }};
+                function {{ this.get_name() }}_load() {
+                    var map = {{ this._parent.get_name() }};
+                    if (map.getZoom() < {{ this.min_zoom }}) {
+                        return;
+                    }
+                    var view = map.getBounds();
+                    {{ this.get_name() }}_chunks.forEach(function(chunk) {
+                        if (chunk.loaded || !view.intersects(L.latLngBounds(chunk.bounds))) {
+                            return;
+                        }
+                        chunk.loaded = true;
+                        fetch(chunk.url)
+                            .then(function(response) { return response.json(); })
+                            .then(function(data) { {{ this.get_name() }}.addData(data); })
+                            .catch(function() { chunk.loaded = false; });
+                    });
+                }
+
+                {{ this._parent.get_name() }}.on('moveend', {{ this.get_name() }}_load);
+                {{ this.get_name() }}_load();
+                {% endif %}
+            {% endmacro %}
 """
-imgJs = """<script type="text/javascript">
-const image = document.getElementById('image');
-var imageIndex = 0;
-const imagePaths = [""" + ','.join(['"images/' + x + '"' for x in pics]) + """];
-function showImg(inc) {
-    if (imageIndex == 0 && inc < 0){
-        imageIndex = imagePaths.length + inc;
-    } else {
-        imageIndex = imageIndex + inc;
-    }
-    
-    if (imageIndex >= imagePaths.length) {
-        imageIndex = imageIndex - imagePaths.length;
-    }
-    image.src = imagePaths[imageIndex]; // Path or URL to image
-}
-</script>
+
+# marker for a located picture, row is [lat, lon, thumb, display, original]. The thumbnail
+# is the marker icon so it is only fetched once the marker is out of its cluster. folium
+# assigns this to its own callback variable, so it is a bare function expression
+photoCallbackText = \
 """
-# generate text for html
-htmlText  = """
-<!DOCTYPE html>
-<html>
-    <head>
-        <link rel="stylesheet" href="w3.css">
-        <link rel="stylesheet" href="sidebar.css">
-        <link rel="stylesheet" href="imGal.css">
+                function (row) {
+                    var icon = L.divIcon({
+                        html: '<img src="' + row[2] + '" style="width:{{ size }}px; height:{{ size }}px; object-fit:cover; border:2px solid white; border-radius:4px;">',
+                        className: '',
+                        iconSize: [{{ size + 4 }}, {{ size + 4 }}]
+                    });
+                    var marker = L.marker(new L.LatLng(row[0], row[1]), {icon: icon});
+                    marker.bindPopup('<a href="' + row[4] + '" target="_blank"><img src="' + row[3] + '" style="max-width:300px; max-height:300px;"></a>',
+                                     {maxWidth: 320});
+                    return marker;
+                }
+"""
+
+# join json lists that were serialised separately into one list
+def joinJsonLists(texts):
+    return '[' + ', '.join(text[1:-1] for text in texts if text != '[]') + ']'
+
+# the map layers of one group of tracks - heat map, tracks and their bounds. key names the
+# sidecar folder for the group. Heat map cells and track geojson are serialised here, so
+# the layers of a year are worked out when its page is built and reused as they are by
+# the all time map
+def createMapLayers(name, key, hmData, tracks, infos):
+    import jinja2.utils
+
+    layers = {'name': name, 'tracks': tracks, 'infos': infos}
+    points = np.concatenate(hmData) if hmData else np.zeros((0, 2))
+    if heatMapMode == 'grid':
+        layers['heat'] = []
+        for zoom, cells in binZoomLevels(points[:, 0], points[:, 1], hmZooms, hmCellSize, 1 / hmDownsample):
+            print('Heat map zoom ' + str(zoom) + ': ' + str(len(cells)) + ' cells')
+            layers['heat'].append((zoom, json.dumps(np.round(cells, 5).tolist())))
+    else:
+        layers['heat'] = json.dumps(points[0::hmDownsample].tolist())
+
+    if trackMode == 'sidecar':
+        # write geometry to geojson files, the page only holds the chunk index
+        layers['chunks'] = writeSidecar(tracks, infos, os.path.join(trackFolder, key), trackChunkSize)
+        print('Wrote ' + str(len(tracks)) + ' tracks to ' + str(len(layers['chunks'])) + ' sidecar chunks')
+    elif trackMode == 'layer':
+        layers['data'] = jinja2.utils.htmlsafe_json_dumps(trackCollection(tracks, infos), sort_keys=True)
+
+    allPoints = np.concatenate(tracks)
+    layers['bounds'] = [allPoints.min(axis=0).tolist(), allPoints.max(axis=0).tolist()]
+    return layers
+
+# layerGroups is a list of createMapLayers results, each set of tracks is shown as its own
+# layer and the heat maps are combined. pics are gallery entries, those with a location
+# are shown as a clustered layer of thumbnails
+def createMap(layerGroups, pics=()):
+    import folium
+    import folium.plugins
+    from branca.element import Template, MacroElement
+
+    # create map view of all walks
+    m = folium.Map([48.0, 5.0], zoom_start=6)
+    # branca parses each element's script again as a template while rendering, so the
+    # serialised heat cells and tracks only go in as placeholders. renderMap swaps the
+    # text in once the page is rendered
+    m.mapData = {}
+
+    # heat map based on all data. The heat layer adds up points that fall together, so
+    # cells of the groups can be listed one after another
+    if heatMapMode == 'grid':
+        # one pre-binned heat map per zoom level, swapped in and out of the group on zoom
+        heatGroup = folium.FeatureGroup(name="Heat Map").add_to(m)
+        switch = MacroElement()
+        switch._template = Template(heatSwitchTemplateText)
+        switch.group = heatGroup
+        switch.bands = []
+        for band in range(0, len(hmZooms)):
+            heat = folium.plugins.HeatMap([],
+                                          min_opacity = 0.5,
+                                          radius = 15,
+                                          control = False,
+                                          show = False,
+                                          )
+            heat._template = Template(heatLayerTemplateText)
+            heat.data_text = '/*' + heat.get_name() + '*/'
+            m.mapData[heat.data_text] = joinJsonLists([layers['heat'][band][1] for layers in layerGroups])
+            heat.add_to(heatGroup)
+            switch.bands.append((hmZooms[band], heat))
+        switch.add_to(m)
+    else:
+        heat = folium.plugins.HeatMap([], name="Heat Map",
+                                      min_opacity = 0.5,
+                                      radius = 15,
+                                      )
+        heat._template = Template(heatLayerTemplateText)
+        heat.data_text = '/*' + heat.get_name() + '*/'
+        m.mapData[heat.data_text] = joinJsonLists([layers['heat'] for layers in layerGroups])
+        heat.add_to(m)
+
+    # one layer group per set of tracks, so they can be shown and hidden separately
+    for layers in layerGroups:
+        trackGroup = folium.FeatureGroup(name=layers['name']).add_to(m)
+        if trackMode in ('layer', 'sidecar'):
+            layer = MacroElement()
+            layer._template = Template(trackLayerTemplateText)
+            layer.group = trackGroup
+            layer.canvas = trackCanvas
+            layer.popup_max_width = popupMaxWidth
+            if trackMode == 'sidecar':
+                layer.chunks = layers['chunks']
+                layer.min_zoom = trackMinZoom
+            else:
+                layer.chunks = None
+                layer.data = '/*' + layer.get_name() + '*/'
+                m.mapData[layer.data] = layers['data']
+            layer.add_to(m)
+        else:
+            tracks, infos = layers['tracks'], layers['infos']
+            for iii in range(0, len(tracks)):
+                track = tracks[iii].tolist()
         
-        <script src="https://cdn.bokeh.org/bokeh/release/bokeh-3.6.2.min.js"
-            crossorigin="anonymous">
-        </script> """ +\
-        script +\
-        """
-    </head>
-    
-    <style>
-        .content {
-            max-width: """ + str(max(plotWidth, mapWidth)) + """px;
-            margin: auto;
-        }
-    </style>
-
-    <body>
-        <!-- Side navigation -->
-        <div class="sidenav">
-          <a href="#notes">Notes</a>
-          <a href="#map">Map</a>
-          <a href="#plots">Plots</a>
-          <a href="#pics">Pictures</a>
-          <a href="#nerds">For Nerds</a>
-        </div>
+                # create line object
+                line = folium.PolyLine(
+                    locations=track,
+                    color="black",
+                    weight=2,
+                    tooltip=infos[iii],
+                    popup=folium.Popup(infos[iii], max_width=popupMaxWidth),
+                )
+                # update template to add hover behaviour
+                line._template = Template(templateText)
         
-        <div class="main">
-            <h1 id="notes">Notes</h1>
-                <p>In the first few months of 2024, I decided that I would like to try and walk 1000km in 2024.
+                # add line to track group - this will show as single item in legend
+                line.add_to(trackGroup)
+
+    located = [pic for pic in pics if pic.get('location') is not None]
+    if len(located) > 0:
+        rows = [[round(pic['location'][0], 6), round(pic['location'][1], 6),
+                 pic['thumb'], pic['display'], pic['original']] for pic in located]
+        folium.plugins.FastMarkerCluster(rows, name='Pictures',
+                                         callback=Template(photoCallbackText).render(size=photoIconSize),
+                                         ).add_to(m)
+
+    # add legend and layer selection
+    folium.LayerControl().add_to(m)
+
+    # fit map to data, this adjusts default zoom. Bounds come from the tracks as
+    # they are not all folium elements
+    bounds = np.array([layers['bounds'] for layers in layerGroups])
+    m.fit_bounds([bounds[:, 0].min(axis=0).tolist(), bounds[:, 1].max(axis=0).tolist()], padding=(30, 30))
+
+    return m
+
+##################################################################
+### Create HTML Doc
+##################################################################
+
+# notes for the 2024 page, the year this all started
+def createNotes2024(total):
+    return """                <p>In the first few months of 2024, I decided that I would like to try and walk 1000km in 2024.
                 This included only "going out for a walk", so not just distance walked around at work, walking
                 to the pub, lunchtime walks at work, etc. I tracked all the activities that I wanted to count
                 and have plotted the results here. This ended up being a bit of a Britain farewell tour as at
                 the beginning of 2025 I left the UK for a new adventure. In the end, I logged <b>
-                """ + str(round(max(monthCumulative), 1)) + """km/""" + str(round(max(monthCumulative)/1.6, 1)) + \
-                """miles</b> of walking/hiking in 2024 - That works out to 
-                """ + str(round(max(monthCumulative)/12, 1)) + """km/""" + str(round(max(monthCumulative)/12/1.6, 1)) + \
-                """miles per month or """ + \
-                str(round(max(monthCumulative)/52, 1)) + """km/""" + str(round(max(monthCumulative)/52/1.6, 1)) + \
-                """miles per week on average!
+                """ + str(round(total, 1)) + """km/""" + str(round(total/1.6, 1)) + \
+                    """miles</b> of walking/hiking in 2024 - That works out to 
+                """ + str(round(total/12, 1)) + """km/""" + str(round(total/12/1.6, 1)) + \
+                    """miles per month or """ + \
+                    str(round(total/52, 1)) + """km/""" + str(round(total/52/1.6, 1)) + \
+                    """miles per week on average!
                 </p>
                 <p>Walks included significant sections of the following notable long distance paths:</p>
                 <ul>
@@ -399,53 +793,367 @@ htmlText  = """
                     <li><a href="https://ldwa.org.uk/ldp/members/show_path.php?path_name=Cotswold+Way+National+Trail" target="_blank">Cotswold Way National Trail</a></li>
                     <li>And probably others I have forgotten...</li>
                 </ul>
-                <p>Notes on functionality:</p>
-                <ul>
-                    <li>Hovering over a track on the map will give more information.</li>
-                    <li>Hovering over a track will also bring it to the front of the map and highlight it.</li>
-                    <li>Clicking a track will keep the popup visible.</li>
-                    <li>The heat map or tracks can be hidden in the layer control at the top right of the map.</li>
-                    <li>In the plot section, hovering over lines will give more information.</li>
-                </ul>
-            <h1 id="map">Map of Walks</h1>\n\t\t""" + \
-                iframe + "\n" + \
-            """<h1 id="plots">Data Plots</h1>\n""" + \
-                "\t\t" + divs['monthPlot'] + "\n" + \
-                "\t\t" + divs['weekPlot'] + "\n" + \
-"""         <h1 id="pics">Pictures</h1>
-            """ + imgTag + '\n' + imgJs + """\n
-            <h1 id="nerds">Info for Nerds</h1>
-                <p>This section has a bit of info about how this page was made</p>
-                <ul>
-                    <li>Data was tracked in MapMyRun as I had used this previously. 
-                        Any tracking that allows Garmin TCX files to be exported is compatible.
-                    </li>
-                    <li>I wrote a python script to download all data from my MapMyRun account following the process here:
-                        <a href="https://www.reddit.com/r/running/comments/16p743j/download_all_tcx_running_history_from_mapmyrun/?rdt=65271" target = "_blank">Reddit: Download All TCX Running History from Mapmyrun</a>
-                    </li>
-                    <li>I was too lazy to write my own TCX parser, so I used this
-                        <a href="https://pypi.org/project/tcxreader/0.3.12/" target="_blank">TCXReader Module</a>
-                    </li>
-                    <li>Maps are created using <a href="https://python-visualization.github.io/folium/latest/index.html" target="_blank">Folium</a>
-                        <ul>
-                            <li>Some customisation was required to get track behaviour to work how I wanted it</li>
-                            <li>This requires writing javascript to interact with the <a href="https://leafletjs.com/" target="_blank">LeafletJS</a> that folium generates</li>
-                        </ul>
-                    </li>
-                    <li>Plots are generate using <a href="https://docs.bokeh.org/en/latest/index.html" target="_blank">Bokeh</a>
-                        <ul>
-                            <li>I had used bokeh quite a lot for work in the past</li>
-                            <li>Functionality here is very basic, it would probably be possible to link between bokeh and leaflet on the JS side if I cared to figure it out.</li>
-                        </ul>
-                    </li>
-                </ul>
-        </div>
-    </body>
-</html>
 """
 
-with open('index.html', 'w') as f:
-    f.write(htmlText)
+# notes for any other year, or for all years when the table covers more than one
+def createNotes(table):
+    total = table['distance'].sum()
+    years = sorted(table['year'].unique())
+    text = '                <p>I logged <b>' + str(round(total, 1)) + 'km/' + str(round(total/1.6, 1)) + \
+           'miles</b> of walking/hiking over ' + str(len(table)) + ' walks'
+    if len(years) == 1:
+        text += ' in ' + str(years[0]) + '.</p>\n'
+    else:
+        text += ' between ' + str(years[0]) + ' and ' + str(years[-1]) + ':</p>\n'
+        text += '                <ul>\n'
+        for year, yearTable in table.groupby('year'):
+            text += '                    <li><a href="' + pageFile(year) + '">' + str(year) + '</a>: ' + \
+                    str(round(yearTable['distance'].sum(), 1)) + 'km over ' + str(len(yearTable)) + ' walks</li>\n'
+        text += '                </ul>\n'
+    return text
+
+# where the selected walks went - cells covered each year and how many were new, the most
+# walked spot and routes that were walked more than once
+def createCoverage(index, table, dataSets, selected):
+    cellArea = cellSize * cellSize / 1e6 # km2
+    text = '                <p>The map is split into ' + str(cellSize) + 'm squares to count where the walks went.</p>\n'
+    text += '                <ul>\n'
+    years = sorted(table['year'].iloc[selected].unique())
+    for coverYear in years:
+        cells = index.coveredCells(np.flatnonzero(table['year'] == coverYear))
+        earlier = index.coveredCells(np.flatnonzero(table['year'] < coverYear))
+        new = np.setdiff1d(cells, earlier, assume_unique=True)
+        text += '                    <li>' + str(coverYear) + ': ' + str(len(cells)) + ' squares, about ' + \
+                str(round(len(cells) * cellArea, 1)) + 'km<sup>2</sup>'
+        if len(earlier) > 0:
+            text += ', ' + str(len(new)) + ' not walked in earlier years'
+        text += '</li>\n'
+    text += '                </ul>\n'
+
+    busiest, count = index.busiestCell(selected)
+    if busiest is not None and count > 1:
+        latitude, longitude = cellCentres(np.array([busiest]))
+        nearby = index.near(latitude[0], longitude[0], cellSize, dataSets)
+        text += '                <p>The most walked spot, <a href="https://www.openstreetmap.org/?mlat=' + \
+                str(round(latitude[0], 5)) + '&mlon=' + str(round(longitude[0], 5)) + '#map=16/' + \
+                str(round(latitude[0], 5)) + '/' + str(round(longitude[0], 5)) + '" target="_blank">here</a>, ' + \
+                'was passed on ' + str(count) + ' walks and ' + str(len(nearby)) + ' came within ' + str(cellSize) + 'm of it.</p>\n'
+
+    routes = index.repeatedRoutes(selected)
+    if len(routes) > 0:
+        text += '                <p>Routes walked more than once:</p>\n'
+        text += '                <ul>\n'
+        for route in routes:
+            text += '                    <li>' + ', '.join(table['name'].iloc[iii] + ' (' + table['startTime'].iloc[iii].strftime('%d-%b-%Y') + ')'
+                                                 for iii in route) + '</li>\n'
+        text += '                </ul>\n'
+    return text
+
+# write the map to its own page, shown on the walk page in an iframe. Returns the
+# map file name relative to the page. The page is written in pieces split on the
+# /*name*/ placeholders, with each placeholder's data written in its place, so the
+# layer data is never copied into the page string
+def renderMap(m, mapFile):
+    mapData = getattr(m, 'mapData', {})
+    with open(mapFile, 'w', encoding='utf-8') as f:
+        for piece in re.split(r'(/\*\w+\*/)', m.get_root().render()):
+            f.write(mapData.get(piece, piece))
+    return os.path.basename(mapFile)
+
+# map page for a walk page, e.g. index_map.html for index.html
+def mapFileFor(fileName):
+    return os.path.splitext(fileName)[0] + '_map.html'
+
+# prepare for embedding bokeh plots. plots is a list of (name, plot), returns the
+# script and the divs in the same order
+def embedPlots(plots):
+    import bokeh.embed as embed
+
+    plotDict = dict(plots)
+            
+    script, divs = embed.components(plotDict)
+    return script, [divs[name] for name, plot in plots]
+
+# write a page from the page template, streamed to the file as it is rendered.
+# mapFile is the map page, script and divs the embedded plots in display order, pics
+# the gallery entries and pageLinks a list of (file, label) for the other pages of the build
+def createHtml(fileName, mapFile, script, divs, notes, coverage, pics, pageLinks):
+    import jinja2
+
+    pageTemplates = jinja2.Environment(loader=jinja2.FileSystemLoader(templateFolder), trim_blocks=True)
+    template = pageTemplates.get_template(pageTemplate)
+    template.stream(script=script,
+                    contentWidth=max(plotWidth, mapWidth),
+                    pageLinks=pageLinks,
+                    notes=notes,
+                    mapFile=mapFile,
+                    mapWidth=mapWidth,
+                    mapHeight=mapHeight,
+                    coverage=coverage,
+                    divs=divs,
+                    pics=pics,
+                    ).dump(fileName, encoding='utf-8')
+
+##################################################################
+### Build
+##################################################################
+
+class WalkArchive:
+    # the tracks and pictures of a build and everything worked out from them, kept in
+    # memory between builds so a refresh only parses, simplifies and hashes the files
+    # that changed. main builds once, watch refreshes whenever the folders change
+
+    def __init__(self, jobs=1):
+        self.jobs = jobs
+        self.cache = TrackCache(os.path.join(cacheFolder, 'tracks'))
+        self.indexFile = os.path.join(cacheFolder, 'index.npz')
+        self.index = TrackIndex.load(self.indexFile)
+        self.loaded = {}      # data file -> (track id, activity)
+        self.merged = {}      # track id -> points, simplified points, popup text and stats from mergeTracks
+        self.imageHashes = {} # picture file -> (size, mtime, content hash) for buildGallery
+        self.years = []
+        self.pics = []
+        self.picTimes = {}    # (picture file, display variant) -> time taken from photoTime
+        self.mapLayers = {}   # year -> createMapLayers of the year's tracks, reused by the all time map
+        self.table = None
+
+    # bring the archive in line with the files on disk for the given years. Returns the
+    # years whose pages have changed - every year on the first refresh or when the list
+    # of years changes, otherwise the years of the tracks and pictures that changed
+    def refresh(self, years):
+        from imageGallery import buildGallery
+        from photoGeotag import photoTime, locatePhotos
+
+        dataFiles, ids, archived = findTracks(years)
+        fileIds = dict(zip(dataFiles, ids))
+
+        changedYears = set(years) if list(years) != self.years else set()
+        self.years = list(years)
+
+        # parse new and changed tracks, drop removed ones
+        toLoad = [dataFiles[iii] for iii in range(0, len(dataFiles))
+                  if self.loaded.get(dataFiles[iii], (None, None))[0] != ids[iii]]
+        removed = set(self.loaded) - set(dataFiles)
+        if len(toLoad) > 0:
+            with Stage('load', len(toLoad)):
+                dataSets, loadedFiles = loadAllTracks(toLoad, archived, jobs=self.jobs, cache=self.cache)
+            for file in set(toLoad) - set(loadedFiles):
+                # failed to parse, the previous version is dropped too
+                removed.add(file)
+            for file, dataSet in zip(loadedFiles, dataSets):
+                if file in self.loaded:
+                    changedYears.add(self.loaded[file][1].startTime.year)
+                self.loaded[file] = (fileIds[file], dataSet)
+                changedYears.add(dataSet.startTime.year)
+        for file in removed:
+            if file in self.loaded:
+                changedYears.add(self.loaded.pop(file)[1].startTime.year)
+
+        if len(toLoad) > 0 or len(removed) > 0 or self.table is None:
+            self.files = [file for file in dataFiles if file in self.loaded]
+            self.ids = [self.loaded[file][0] for file in self.files]
+            self.dataSets = [self.loaded[file][1] for file in self.files]
+            points = sum(len(dataSet) for dataSet in self.dataSets)
+            with Stage('index', points):
+                if self.index.update(self.ids, self.dataSets):
+                    self.index.save(self.indexFile)
+                print('Indexed ' + str(len(self.dataSets)) + ' tracks over ' +
+                      str(len(self.index.coveredCells())) + ' grid cells')
+            with Stage('merge', points):
+                self.hmData, self.tracks, self.infos, stats = mergeTracks(self.dataSets, self.ids, self.merged)
+                self.merged = {id: self.merged[id] for id in self.ids}
+            with Stage('aggregate', len(self.dataSets)):
+                self.table = buildActivityTable(self.dataSets, stats)
+
+        with Stage('gallery') as stage:
+            pics = buildGallery(sorted(os.listdir(imageFolder)), imageFolder, galleryFolder,
+                                jobs=self.jobs, hashes=self.imageHashes)
+            stage.items = len(pics)
+
+            # place pictures on the tracks from the time they were taken. The display variant is
+            # named by the picture's content, so only new or changed pictures are read again
+            picTimes = {}
+            for pic in pics:
+                key = (pic['original'], pic['display'])
+                picTimes[key] = self.picTimes[key] if key in self.picTimes else photoTime(pic['original'])
+            self.picTimes = picTimes
+            latitude, longitude, picActivity = locatePhotos(self.dataSets, [picTimes[(pic['original'], pic['display'])]
+                                                                            for pic in pics])
+            for iii in range(0, len(pics)):
+                pics[iii]['location'] = None if picActivity[iii] < 0 else [latitude[iii], longitude[iii]]
+        print('Placed ' + str(np.count_nonzero(picActivity >= 0)) + ' of ' + str(len(pics)) + ' pictures on the map')
+
+        # pictures that were added, removed, resized again or moved on the map
+        before = {pic['original']: (pic['display'], pic['location']) for pic in self.pics}
+        after = {pic['original']: (pic['display'], pic['location']) for pic in pics}
+        for original in set(before) | set(after):
+            if before.get(original) != after.get(original):
+                changedYears.add(self.picYear(original))
+        self.pics = pics
+
+        return changedYears
+
+    # year page a picture is shown on, pictures with no date go on the main page
+    def picYear(self, fileName):
+        picYear = imageYear(fileName)
+        return year if picYear is None else picYear
+
+    # write the pages of the given years and the all time page
+    def buildPages(self, buildYears):
+        table = self.table
+        pageLinks = [(pageFile(pageYear), str(pageYear)) for pageYear in self.years] + [(allTimeFile, 'All Years')]
+        builtYears = []
+        for pageYear in self.years:
+            selected = np.flatnonzero(table['year'] == pageYear)
+            if len(selected) == 0:
+                print('No tracks for ' + str(pageYear))
+                self.mapLayers.pop(pageYear, None)
+                continue
+            builtYears.append(pageYear)
+            if pageYear not in buildYears and pageYear in self.mapLayers:
+                continue
+            with Stage('map layers', len(selected)):
+                self.mapLayers[pageYear] = createMapLayers('Tracks ' + str(pageYear), str(pageYear),
+                                                           [self.hmData[iii] for iii in selected],
+                                                           [self.tracks[iii] for iii in selected],
+                                                           [self.infos[iii] for iii in selected])
+            if pageYear not in buildYears:
+                continue
+            print('Building ' + pageFile(pageYear))
+
+            with Stage('aggregate', len(selected)):
+                monthData, weekData = aggregateDistances(table, pageYear)
+                coverage = createCoverage(self.index, table, self.dataSets, selected)
+            with Stage('plot', 2):
+                plots = createPlots(monthData, weekData)
+                script, divs = embedPlots(plots)
+            if pageYear == 2024:
+                notes = createNotes2024(monthData['cumulative'].max())
+            else:
+                notes = createNotes(table.iloc[selected])
+            yearPics = [pic for pic in self.pics if self.picYear(pic['original']) == pageYear]
+            with Stage('map', len(selected)):
+                mapFile = renderMap(createMap([self.mapLayers[pageYear]], yearPics), mapFileFor(pageFile(pageYear)))
+            with Stage('html', 1):
+                createHtml(pageFile(pageYear), mapFile, script, divs, notes, coverage, yearPics, pageLinks)
+
+        if len(builtYears) > 0:
+            print('Building ' + allTimeFile)
+            selected = np.flatnonzero(table['year'].isin(builtYears))
+            with Stage('aggregate', len(selected)):
+                coverage = createCoverage(self.index, table, self.dataSets, selected)
+            with Stage('plot', 2):
+                plots = createAllTimePlots(table, builtYears)
+                script, divs = embedPlots(plots)
+            with Stage('map', len(selected)):
+                # the years' layers are reused, only the years that changed were worked out again
+                mapFile = renderMap(createMap([self.mapLayers[pageYear] for pageYear in builtYears], self.pics),
+                                    mapFileFor(allTimeFile))
+            with Stage('html', 1):
+                createHtml(allTimeFile, mapFile, script, divs, createNotes(table.iloc[selected]), coverage,
+                           self.pics, pageLinks)
+
+# build a page for each year plus the all time page. Tracks are loaded, simplified and
+# their stats computed once, each page only selects its own tracks from the results
+def main(years, jobs=1):
+    archive = WalkArchive(jobs)
+    archive.refresh(years)
+    archive.buildPages(years)
+
+# size and modification time of every tcx file, track archive and picture
+def watchSnapshot():
+    from imageGallery import isImage
+
+    snapshot = {}
+    folders = [os.path.join(dataFolder, folder) for folder in os.listdir(dataFolder)
+               if folder.isdigit() and os.path.isdir(os.path.join(dataFolder, folder))] + [imageFolder]
+    for folder in folders:
+        for entry in os.scandir(folder):
+            if folder == imageFolder:
+                wanted = isImage(entry.name)
+            else:
+                wanted = entry.name.endswith('.tcx') or entry.name == archiveName
+            if entry.is_file() and wanted:
+                stat = entry.stat()
+                snapshot[entry.path] = (stat.st_size, stat.st_mtime_ns)
+    return snapshot
+
+# build the pages, then rebuild them whenever tcx files, track archives or pictures are added, changed or
+# removed. The folders are polled every watchInterval seconds and a rebuild waits until
+# nothing has changed for watchSettle seconds, so a batch of copied files is built once.
+# Only the pages of the years that changed and the all time page are rewritten
+def watch(years, jobs=1):
+    archive = WalkArchive(jobs)
+    buildYears = years if years else findYears()
+    archive.refresh(buildYears)
+    archive.buildPages(buildYears)
+
+    snapshot = watchSnapshot()
+    print('Watching ' + dataFolder + ' and ' + imageFolder + ' for changes, Ctrl+C to stop')
+    try:
+        while True:
+            time.sleep(watchInterval)
+            current = watchSnapshot()
+            if current == snapshot:
+                continue
+
+            # wait for a burst of file events to finish
+            while True:
+                time.sleep(watchSettle)
+                latest = watchSnapshot()
+                if latest == current:
+                    break
+                current = latest
+            snapshot = current
+
+            start = time.perf_counter()
+            buildYears = years if years else findYears()
+            changedYears = archive.refresh(buildYears)
+            if len(changedYears) == 0:
+                print('No pages affected')
+                continue
+            archive.buildPages(changedYears)
+            print('Rebuilt ' + ', '.join(str(changed) for changed in sorted(changedYears)) + ' in ' +
+                  str(round(time.perf_counter() - start, 2)) + 's')
+    except KeyboardInterrupt:
+        print('Stopped watching')
+
+# build once or watch, optionally measuring each stage and writing cProfile stats to
+# profileDump. years of None builds every year in the data folder
+def build(years, jobs=1, watching=False, profile=False, profileDump=None):
+    stageProfile.enabled = profile or profileDump is not None
+    profiler = cProfile.Profile() if profileDump else None
+    if profiler is not None:
+        profiler.enable()
+    if watching:
+        watch(years, jobs=jobs)
+    else:
+        main(years if years else findYears(), jobs=jobs)
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(profileDump)
+        print('Wrote profile to ' + profileDump)
+    if stageProfile.enabled:
+        stageProfile.report()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the walk pages from the walk data')
+    parser.add_argument('--years', type=int, nargs='+', default=None,
+                        help='years to build (default: every year in the data folder)')
+    parser.add_argument('--year', type=int, default=year,
+                        help='year written to index.html (default: %(default)s)')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(),
+                        help='number of processes used to parse tracks (default: number of cores)')
+    parser.add_argument('--watch', action='store_true',
+                        help='keep running and rebuild the pages when tcx files or pictures change')
+    parser.add_argument('--profile', action='store_true',
+                        help='print the time and memory used by each stage and the slowest files to parse')
+    parser.add_argument('--profile-dump', default=None, metavar='FILE',
+                        help='also write cProfile stats of the build to FILE, for pstats or snakeviz')
+    args = parser.parse_args()
+
+    year = args.year
+    build(args.years, jobs=args.jobs, watching=args.watch, profile=args.profile, profileDump=args.profile_dump)
 
 # not used - for debug only. Old method of saving fullscreen map
 
@@ -0,0 +1,103 @@
+import os
+import sys
+import time
+try:
+    import resource
+except ImportError:
+    # not available on windows, peak memory is then left out
+    resource = None
+
+##################################################################
+### Build stage instrumentation
+##################################################################
+
+# stages are only measured when this is set, otherwise Stage does nothing
+enabled = False
+
+# finished stages and per file parse times, in the order they were recorded
+stageRecords = []
+fileRecords = []
+
+# number of slowest files listed in the report
+reportFiles = 10
+
+
+# peak resident memory in MB of this process and of any worker processes it started
+def peakMemory():
+    if resource is None:
+        return None, None
+    # ru_maxrss is in bytes on macOS and kB elsewhere
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return (round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1),
+            round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale, 1))
+
+
+# cpu time of this process and its finished worker processes
+def cpuTime():
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+class Stage:
+    # times a block of the build when profiling is enabled. Set items to the number of
+    # things the stage handled, e.g. tracks or points, for the report
+    #   with Stage('merge') as stage:
+    #       ...
+    #       stage.items = len(dataSets)
+
+    def __init__(self, name, items=None):
+        self.name = name
+        self.items = items
+
+    def __enter__(self):
+        if enabled:
+            self.wall = time.perf_counter()
+            self.cpu = cpuTime()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if enabled:
+            peak, peakWorkers = peakMemory()
+            stageRecords.append({'stage': self.name,
+                                 'items': self.items,
+                                 'wall': time.perf_counter() - self.wall,
+                                 'cpu': cpuTime() - self.cpu,
+                                 'peakMemory': peak,
+                                 'peakWorkerMemory': peakWorkers,
+                                 })
+        return False
+
+
+# record how long a file took to parse, with its size and the points kept from it
+def recordFile(fileName, seconds, points):
+    if enabled:
+        fileRecords.append({'file': fileName, 'seconds': seconds,
+                            'bytes': os.path.getsize(fileName), 'points': points})
+
+
+# print a table of the stages, repeated stages are added together, and the slowest files
+def report():
+    totals = {}
+    for record in stageRecords:
+        if record['stage'] not in totals:
+            totals[record['stage']] = {'calls': 0, 'items': 0, 'wall': 0, 'cpu': 0}
+        total = totals[record['stage']]
+        total['calls'] += 1
+        total['items'] += record['items'] or 0
+        total['wall'] += record['wall']
+        total['cpu'] += record['cpu']
+        total['peakMemory'] = record['peakMemory']
+
+    print('{:<16} {:>6} {:>10} {:>10} {:>10} {:>10}'.format('Stage', 'Calls', 'Items', 'Wall (s)', 'CPU (s)', 'Peak (MB)'))
+    for name, total in totals.items():
+        print('{:<16} {:>6} {:>10} {:>10.3f} {:>10.3f} {:>10}'.format(name, total['calls'], total['items'], total['wall'],
+                                                                     total['cpu'], str(total['peakMemory'])))
+    peakWorkers = peakMemory()[1]
+    if peakWorkers:
+        print('Peak worker process memory: ' + str(peakWorkers) + ' MB')
+
+    if len(fileRecords) > 0:
+        print('Slowest files to parse:')
+        for record in sorted(fileRecords, key=lambda record: -record['seconds'])[:reportFiles]:
+            print('{:>8.3f}s {:>8.1f} MB {:>8} points  {}'.format(record['seconds'], record['bytes'] / 1e6,
+                                                                record['points'], record['file']))
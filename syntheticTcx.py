@@ -0,0 +1,116 @@
+import os
+import argparse
+import numpy as np
+from trackSimplify import earthRadius
+
+##################################################################
+### Synthetic TCX archives for benchmarking
+##################################################################
+
+# areas walks start from, each walk starts within startSpread degrees of one of them
+startAreas = [(51.76, -1.26), (54.42, -1.99), (51.88, -3.43), (53.37, -1.81), (50.85, -0.37)]
+startSpread = 0.15
+
+# walk length range and pace, points are logged once a second like MapMyRun does
+walkMinutes = (20, 180)
+walkSpeed = 1.3 # m/s
+
+# MapMyRun follows each positioned point with one carrying only the distance and a
+# few carrying only a time stamp. The parser has to skip these so they are kept
+timeOnlyPoints = 3
+
+tcxHeader = '<?xml version="1.0" encoding="UTF-8"?><TrainingCenterDatabase ' \
+            'xmlns="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2" ' \
+            'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" ' \
+            'xsi:schemaLocation="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2 ' \
+            'http://www.garmin.com/xmlschemas/TrainingCenterDatabasev2.xsd"><Activities>'
+tcxFooter = '</Activities></TrainingCenterDatabase>'
+
+
+# tcx time stamps for epoch seconds, flattened to a list
+def timeStamps(seconds):
+    microseconds = np.round(np.ravel(seconds) * 1e6).astype('datetime64[us]')
+    return [text + '+00:00' for text in np.datetime_as_string(microseconds, unit='us')]
+
+
+# point arrays of a random walk - the heading wanders, the walker stops now and then
+# and the elevation drifts. Returns time offsets, latitude, longitude, elevation and distance
+def randomWalk(random, minutes):
+    count = int(minutes * 60)
+    heading = random.uniform(0, 2 * np.pi) + np.cumsum(random.normal(0, 0.08, count))
+    speed = walkSpeed * random.uniform(0.8, 1.2) * (random.random(count) > 0.03)
+    step = speed * random.uniform(0.9, 1.1, count)
+    step[0] = 0
+
+    area = startAreas[random.integers(len(startAreas))]
+    latitude0 = area[0] + random.uniform(-startSpread, startSpread)
+    longitude0 = area[1] + random.uniform(-startSpread, startSpread)
+    north = np.cumsum(step * np.cos(heading))
+    east = np.cumsum(step * np.sin(heading))
+    latitude = latitude0 + np.degrees(north / earthRadius)
+    longitude = longitude0 + np.degrees(east / earthRadius / np.cos(np.radians(latitude0)))
+
+    elevation = random.uniform(20, 400) + np.cumsum(random.normal(0, 0.15, count))
+    times = np.arange(count) + random.uniform(0, 0.5, count)
+    return times, latitude, longitude, elevation, np.cumsum(step)
+
+
+# write one activity starting at the given epoch time
+def writeActivity(fileName, random, start, minutes):
+    times, latitude, longitude, elevation, distance = randomWalk(random, minutes)
+    stamps = timeStamps(start + times)
+    extraStamps = timeStamps(start + times[:, None] + np.linspace(0.02, 0.9, timeOnlyPoints)[None, :])
+
+    parts = [tcxHeader,
+             '<Activity Sport="Running"><Id>', stamps[0], '</Id><Lap StartTime="', stamps[0], '">',
+             '<TotalTimeSeconds>', str(round(times[-1] - times[0], 1)), '</TotalTimeSeconds>',
+             '<DistanceMeters>', repr(float(distance[-1])), '</DistanceMeters><Track>']
+    for iii in range(0, len(times)):
+        parts.append('<Trackpoint><Time>' + stamps[iii] + '</Time><Position><LatitudeDegrees>' +
+                     repr(float(latitude[iii])) + '</LatitudeDegrees><LongitudeDegrees>' +
+                     repr(float(longitude[iii])) + '</LongitudeDegrees></Position><AltitudeMeters>' +
+                     str(round(elevation[iii], 4)) + '</AltitudeMeters></Trackpoint>')
+        parts.append('<Trackpoint><Time>' + extraStamps[iii * timeOnlyPoints] + '</Time><DistanceMeters>' +
+                     str(round(distance[iii], 4)) + '</DistanceMeters></Trackpoint>')
+        for jjj in range(1, timeOnlyPoints):
+            parts.append('<Trackpoint><Time>' + extraStamps[iii * timeOnlyPoints + jjj] + '</Time></Trackpoint>')
+    parts.append('</Track></Lap></Activity>' + tcxFooter)
+
+    with open(fileName, 'w', encoding='utf-8') as f:
+        f.write(''.join(parts))
+    return len(times)
+
+
+# write count activities spread evenly over the given years into dataFolder/<year>.
+# The same seed always gives the same archive. Returns the files written
+def generateArchive(dataFolder, count, years, seed=0, maxMinutes=None):
+    random = np.random.default_rng(seed)
+    minutes = (walkMinutes[0], walkMinutes[1] if maxMinutes is None else max(walkMinutes[0], maxMinutes))
+    files = []
+    points = 0
+    for iii in range(0, count):
+        year = years[iii * len(years) // count]
+        yearStart = np.datetime64(str(year) + '-01-01T00:00:00').astype('datetime64[s]').astype(np.int64)
+        start = yearStart + random.integers(0, 365) * 86400 + random.integers(7 * 3600, 18 * 3600)
+
+        folder = os.path.join(dataFolder, str(year))
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        fileName = os.path.join(folder, 'synthetic_' + str(iii).zfill(5) + '.tcx')
+        points += writeActivity(fileName, random, float(start), random.uniform(*minutes))
+        files.append(fileName)
+        if (iii + 1) % 100 == 0 or iii + 1 == count:
+            print('Wrote ' + str(iii + 1) + ' of ' + str(count) + ' activities, ' + str(points) + ' points')
+    return files
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a synthetic archive of tcx files for benchmarking')
+    parser.add_argument('folder', help='data folder to write to, files go in <folder>/<year>')
+    parser.add_argument('--count', type=int, default=100, help='number of activities (default: %(default)s)')
+    parser.add_argument('--years', type=int, nargs='+', default=[2024], help='years to spread them over (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed (default: %(default)s)')
+    parser.add_argument('--max-minutes', type=float, default=None,
+                        help='cap on walk length, shorter walks make smaller archives (default: %s)' % walkMinutes[1])
+    args = parser.parse_args()
+
+    generateArchive(args.folder, args.count, args.years, seed=args.seed, maxMinutes=args.max_minutes)
@@ -0,0 +1,134 @@
+import os
+import datetime
+import array
+import xml.etree.ElementTree as ET
+import numpy as np
+
+##################################################################
+### Streaming TCX parser
+##################################################################
+
+# all TCX elements live in the garmin namespace
+tcxNamespace = '{http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2}'
+lapTag = tcxNamespace + 'Lap'
+trackTag = tcxNamespace + 'Track'
+trackpointTag = tcxNamespace + 'Trackpoint'
+timeTag = tcxNamespace + 'Time'
+positionTag = tcxNamespace + 'Position'
+latitudeTag = tcxNamespace + 'LatitudeDegrees'
+longitudeTag = tcxNamespace + 'LongitudeDegrees'
+altitudeTag = tcxNamespace + 'AltitudeMeters'
+distanceTag = tcxNamespace + 'DistanceMeters'
+
+
+class Activity:
+    # compact record of one activity - only the columns used for plotting are kept.
+    # point arrays are contiguous float64 and only hold trackpoints with a position.
+    #   latitude, longitude - degrees
+    #   elevation           - metres, NaN where the point has no altitude
+    #   cumDistance         - cumulative distance in metres (last recorded value carried forward)
+    #   time                - seconds since epoch (UTC)
+    # summary fields match the values TCXReader reports
+    #   startTime           - datetime of the first positioned point
+    #   distance            - total lap distance in metres
+    #   duration            - seconds between first and last positioned point
+    __slots__ = ('name', 'latitude', 'longitude', 'elevation', 'cumDistance', 'time',
+                 'startTime', 'distance', 'duration')
+
+    def __init__(self, name, latitude, longitude, elevation, cumDistance, time,
+                 startTime, distance, duration):
+        self.name = name
+        self.latitude = latitude
+        self.longitude = longitude
+        self.elevation = elevation
+        self.cumDistance = cumDistance
+        self.time = time
+        self.startTime = startTime
+        self.distance = distance
+        self.duration = duration
+
+    # number of positioned points in the activity
+    def __len__(self):
+        return len(self.latitude)
+
+
+# parse a TCX time stamp, the 'Z' suffix is not accepted by fromisoformat on older pythons
+def parseTime(text):
+    text = text.strip()
+    if text.endswith('Z'):
+        text = text[:-1] + '+00:00'
+    t = datetime.datetime.fromisoformat(text)
+    if t.tzinfo is None:
+        t = t.replace(tzinfo=datetime.timezone.utc)
+    return t
+
+
+# read a TCX file without building an object per trackpoint. Points without a
+# position are dropped as they are parsed, only their distance is carried forward.
+def readTcx(fileName):
+    latitude = array.array('d')
+    longitude = array.array('d')
+    elevation = array.array('d')
+    cumDistance = array.array('d')
+    times = array.array('d')
+
+    lapDistance = 0.0
+    lastDistance = 0.0
+    startTime = None
+    endTime = None
+    firstTime = None
+
+    for event, elem in ET.iterparse(fileName, events=('end',)):
+        tag = elem.tag
+        if tag == trackpointTag:
+            text = elem.findtext(distanceTag)
+            if text:
+                lastDistance = float(text)
+
+            position = elem.find(positionTag)
+            timeText = elem.findtext(timeTag)
+            if position is not None and timeText:
+                latText = position.findtext(latitudeTag)
+                lonText = position.findtext(longitudeTag)
+                if latText and lonText:
+                    t = parseTime(timeText)
+                    if startTime is None:
+                        startTime = t
+                    endTime = t
+
+                    latitude.append(float(latText))
+                    longitude.append(float(lonText))
+                    text = elem.findtext(altitudeTag)
+                    elevation.append(float(text) if text else np.nan)
+                    cumDistance.append(lastDistance)
+                    times.append(t.timestamp())
+            elif firstTime is None and timeText:
+                firstTime = parseTime(timeText)
+
+            # free the point, it is no longer needed
+            elem.clear()
+        elif tag == trackTag:
+            # points have already been consumed, drop the empty elements
+            elem.clear()
+        elif tag == lapTag:
+            text = elem.findtext(distanceTag)
+            if text:
+                lapDistance += float(text)
+            elem.clear()
+
+    if startTime is None:
+        startTime = firstTime
+        duration = 0.0
+    else:
+        duration = (endTime - startTime).total_seconds()
+
+    return Activity(name=os.path.basename(fileName).replace('.tcx', ''),
+                    latitude=np.frombuffer(latitude, dtype=np.float64),
+                    longitude=np.frombuffer(longitude, dtype=np.float64),
+                    elevation=np.frombuffer(elevation, dtype=np.float64),
+                    cumDistance=np.frombuffer(cumDistance, dtype=np.float64),
+                    time=np.frombuffer(times, dtype=np.float64),
+                    startTime=startTime,
+                    distance=lapDistance,
+                    duration=duration,
+                    )
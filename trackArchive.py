@@ -0,0 +1,277 @@
+import os
+import json
+import mmap
+import argparse
+import datetime
+import numpy as np
+from tcxParser import Activity
+from trackCache import TrackCache
+
+##################################################################
+### PROCESSING AND PATH PARAMETERS
+##################################################################
+
+# base data folder, each year folder gets its own archive
+dataFolder = 'data'
+
+# archive file in each year folder
+archiveName = 'tracks.bin'
+
+# folder for parsed track cache, shared with plotWalkData.py
+cacheFolder = 'cache'
+
+##################################################################
+### Binary track archive
+##################################################################
+
+# file layout, all little endian
+#   magic, version
+#   one record per activity:
+#     recordHeader, utf-8 name, then for each column of archiveColumns the deltas between
+#     consecutive points in the smallest integer type that holds them, and a bit mask of
+#     missing elevations if there are any. The header is a multiple of 8 bytes and every
+#     other part is padded to one, so each part and each record starts on an 8 byte boundary
+#     and the arrays read from the memory map are aligned
+#   index of (offset, size) of each record
+#   json list of the source file of each record, padded to 8 bytes
+#   footer with the index position, record count and length of the key list
+archiveMagic = b'WALKTRK1'
+archiveVersion = 1
+
+# columns stored as integers - latitude and longitude in micro-degrees, elevation and
+# distance in cm and time in ms since the first point
+archiveColumns = (('latitude', 1e6), ('longitude', 1e6), ('elevation', 100), ('cumDistance', 100), ('time', 1000))
+
+deltaTypes = [np.dtype('<i1'), np.dtype('<i2'), np.dtype('<i4'), np.dtype('<i8')]
+
+# 8 byte fields first so each is aligned, the pad brings the header to 96 bytes
+recordHeader = np.dtype([('points', '<u8'),
+                         ('startTime', '<f8'),
+                         ('distance', '<f8'),
+                         ('duration', '<f8'),
+                         ('firstTime', '<f8'),
+                         ('first', '<i8', (len(archiveColumns),)),
+                         ('nameLength', '<u4'),
+                         ('missingElevation', 'u1'),
+                         ('types', 'u1', (len(archiveColumns),)),
+                         ('pad', 'u1', (6,)),
+                         ])
+indexEntry = np.dtype([('offset', '<u8'), ('size', '<u8')])
+footer = np.dtype([('indexOffset', '<u8'), ('count', '<u8'), ('keysLength', '<u8'), ('magic', 'S8')])
+
+
+# zero bytes to the next multiple of 8
+def padding(length):
+    return b'\0' * (-length % 8)
+
+
+# smallest integer type that holds all values
+def deltaType(values):
+    if len(values) == 0:
+        return 0
+    low, high = values.min(), values.max()
+    for code in range(0, len(deltaTypes)):
+        info = np.iinfo(deltaTypes[code])
+        if low >= info.min and high <= info.max:
+            return code
+    return len(deltaTypes) - 1
+
+
+# missing elevations take the last known value so they don't break up the deltas
+def fillMissing(values):
+    valid = np.isfinite(values)
+    if valid.all() or not valid.any():
+        return np.where(valid, values, 0)
+    last = np.maximum.accumulate(np.where(valid, np.arange(len(values)), 0))
+    filled = values[last]
+    filled[:np.argmax(valid)] = values[np.argmax(valid)]
+    return filled
+
+
+# bytes of one archive record
+def encodeActivity(activity):
+    count = len(activity)
+    name = activity.name.encode('utf-8')
+    header = np.zeros(1, dtype=recordHeader)
+    header['points'] = count
+    header['nameLength'] = len(name)
+    header['startTime'] = activity.startTime.timestamp() if activity.startTime else np.nan
+    header['distance'] = activity.distance
+    header['duration'] = activity.duration
+    header['firstTime'] = activity.time[0] if count > 0 else np.nan
+
+    missing = ~np.isfinite(activity.elevation)
+    header['missingElevation'] = missing.any()
+    columns = []
+    for iii, (field, scale) in enumerate(archiveColumns):
+        values = getattr(activity, field)
+        if field == 'time':
+            values = values - header['firstTime'][0]
+        elif field == 'elevation':
+            values = fillMissing(values)
+        values = np.round(values * scale).astype(np.int64)
+        deltas = np.diff(values)
+        code = deltaType(deltas)
+        header['types'][0, iii] = code
+        header['first'][0, iii] = values[0] if count > 0 else 0
+        columns.append(deltas.astype(deltaTypes[code]).tobytes())
+
+    parts = [header.tobytes(), name, padding(len(name))]
+    for column in columns:
+        parts += [column, padding(len(column))]
+    if missing.any():
+        mask = np.packbits(missing).tobytes()
+        parts += [mask, padding(len(mask))]
+    return b''.join(parts)
+
+
+# read one record from a buffer. Only this record's bytes are touched, each column is
+# rebuilt from its deltas in one cumulative sum
+def decodeActivity(buffer, offset):
+    header = np.frombuffer(buffer, dtype=recordHeader, count=1, offset=offset)[0]
+    count = int(header['points'])
+    offset += recordHeader.itemsize
+    nameLength = int(header['nameLength'])
+    name = bytes(buffer[offset:offset + nameLength]).decode('utf-8')
+    offset += nameLength + len(padding(nameLength))
+
+    values = {}
+    for iii, (field, scale) in enumerate(archiveColumns):
+        dtype = deltaTypes[header['types'][iii]]
+        deltas = np.frombuffer(buffer, dtype=dtype, count=max(count - 1, 0), offset=offset)
+        offset += deltas.nbytes + len(padding(deltas.nbytes))
+        column = np.empty(count, dtype=np.int64)
+        if count > 0:
+            column[0] = header['first'][iii]
+            np.cumsum(deltas, out=column[1:], dtype=np.int64)
+            column[1:] += column[0]
+        values[field] = column / scale
+    values['time'] += header['firstTime']
+
+    if header['missingElevation']:
+        maskLength = (count + 7) // 8
+        mask = np.unpackbits(np.frombuffer(buffer, dtype=np.uint8, count=maskLength, offset=offset), count=count)
+        values['elevation'][mask.astype(bool)] = np.nan
+
+    startTime = float(header['startTime'])
+    return Activity(name=name,
+                    startTime=None if np.isnan(startTime) else
+                        datetime.datetime.fromtimestamp(startTime, tz=datetime.timezone.utc),
+                    distance=float(header['distance']),
+                    duration=float(header['duration']),
+                    **values)
+
+
+# write an archive of activities, keys are the source files they came from. Written to a
+# temporary file first so an interrupted import can't leave a broken archive
+def writeArchive(fileName, keys, activities):
+    tmpFile = fileName + '.tmp'
+    index = np.zeros(len(activities), dtype=indexEntry)
+    with open(tmpFile, 'wb') as f:
+        f.write(archiveMagic + np.array(archiveVersion, dtype='<u8').tobytes())
+        for iii in range(0, len(activities)):
+            record = encodeActivity(activities[iii])
+            index[iii] = (f.tell(), len(record))
+            f.write(record)
+        indexOffset = f.tell()
+        f.write(index.tobytes())
+        keyText = json.dumps(list(keys)).encode('utf-8')
+        f.write(keyText + padding(len(keyText)))
+        f.write(np.array([(indexOffset, len(activities), len(keyText), archiveMagic)], dtype=footer).tobytes())
+    os.replace(tmpFile, fileName)
+
+
+class TrackArchive:
+    # read side of an archive. The file is memory mapped, so opening it only reads the
+    # index and reading an activity only touches that activity's record
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+        with open(fileName, 'rb') as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.buffer[:len(archiveMagic)] != archiveMagic:
+            self.close()
+            raise ValueError(fileName + ' is not a track archive')
+        version = int(np.frombuffer(self.buffer, dtype='<u8', count=1, offset=len(archiveMagic))[0])
+        if version != archiveVersion:
+            self.close()
+            raise ValueError(fileName + ' is archive version ' + str(version) + ', expected ' + str(archiveVersion))
+        end = np.frombuffer(self.buffer, dtype=footer, count=1, offset=len(self.buffer) - footer.itemsize)[0]
+        count = int(end['count'])
+        self.index = np.frombuffer(self.buffer, dtype=indexEntry, count=count, offset=int(end['indexOffset']))
+        keyOffset = int(end['indexOffset']) + self.index.nbytes
+        self.keys = json.loads(bytes(self.buffer[keyOffset:keyOffset + int(end['keysLength'])]).decode('utf-8'))
+        self.positions = {key: iii for iii, key in enumerate(self.keys)}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+        return False
+
+    # activity at a position in the archive
+    def read(self, position):
+        return decodeActivity(self.buffer, int(self.index[position]['offset']))
+
+    # activity from a source file, None if it is not in the archive
+    def lookup(self, fileName):
+        position = self.positions.get(TrackCache.key(fileName))
+        if position is None:
+            return None
+        return self.read(position)
+
+    def close(self):
+        # the index is a view of the map, drop it first so the map can close
+        self.index = None
+        self.buffer.close()
+
+##################################################################
+### Import
+##################################################################
+
+# archive every tcx file of a year into data/<year>/tracks.bin. Activities already in the
+# archive whose tcx file has since been removed are kept, so the tcx files can be deleted
+# once imported. Returns the size of the tcx files and of the archive
+def importYear(year, jobs=1):
+    folder = os.path.join(dataFolder, str(year))
+    archiveFile = os.path.join(folder, archiveName)
+    dataFiles = sorted(os.path.join(folder, file) for file in os.listdir(folder) if file.endswith('.tcx'))
+
+    cache = TrackCache(os.path.join(cacheFolder, 'tracks'))
+    loaded, failures = cache.loadAll(dataFiles, jobs=jobs)
+    cache.save()
+    for file in failures:
+        print('Failed to load ' + file + ' - ' + failures[file])
+    activities = {TrackCache.key(dataFiles[iii]): loaded[iii] for iii in range(0, len(dataFiles)) if loaded[iii] is not None}
+
+    if os.path.isfile(archiveFile):
+        with TrackArchive(archiveFile) as archive:
+            for position, key in enumerate(archive.keys):
+                if key not in activities and not os.path.isfile(key):
+                    activities[key] = archive.read(position)
+
+    keys = sorted(activities)
+    writeArchive(archiveFile, keys, [activities[key] for key in keys])
+    tcxSize = sum(os.path.getsize(file) for file in dataFiles)
+    return len(keys), tcxSize, os.path.getsize(archiveFile)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import tcx files into a compact binary archive per year, '
+                                                 'data/<year>/' + archiveName + '. The page build reads activities '
+                                                 'from the archive when their tcx file is not there')
+    parser.add_argument('--years', type=int, nargs='+', default=None,
+                        help='years to import (default: every year in the data folder)')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(),
+                        help='number of processes used to parse tracks (default: number of cores)')
+    args = parser.parse_args()
+
+    years = args.years if args.years else sorted(int(folder) for folder in os.listdir(dataFolder)
+                                                 if folder.isdigit() and os.path.isdir(os.path.join(dataFolder, folder)))
+    for year in years:
+        count, tcxSize, archiveSize = importYear(year, jobs=args.jobs)
+        print('Archived ' + str(count) + ' activities for ' + str(year) + ': ' + str(round(tcxSize / 1e6, 1)) +
+              ' MB of tcx in ' + str(round(archiveSize / 1e6, 2)) + ' MB')
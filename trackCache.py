@@ -0,0 +1,163 @@
+import os
+import json
+import time
+import hashlib
+import datetime
+import concurrent.futures
+import numpy as np
+from tcxParser import Activity, readTcx
+
+##################################################################
+### On-disk cache of parsed tracks
+##################################################################
+
+# bump when the Activity layout or parser output changes to invalidate old entries
+cacheVersion = 1
+
+# failure reported for activities with no positioned points
+noPositionError = 'no trackpoints with a position, nothing to map'
+
+# point arrays stored for each activity
+arrayFields = ('latitude', 'longitude', 'elevation', 'cumDistance', 'time')
+
+
+# write an activity to a single uncompressed npz file
+def saveActivity(fileName, activity):
+    np.savez(fileName,
+             name=np.array(activity.name),
+             startTime=np.array(activity.startTime.isoformat() if activity.startTime else ''),
+             distance=np.array(activity.distance),
+             duration=np.array(activity.duration),
+             **{field: getattr(activity, field) for field in arrayFields})
+
+
+# read an activity written by saveActivity
+def loadActivity(fileName):
+    with np.load(fileName) as data:
+        startTime = str(data['startTime'])
+        return Activity(name=str(data['name']),
+                        startTime=datetime.datetime.fromisoformat(startTime) if startTime else None,
+                        distance=float(data['distance']),
+                        duration=float(data['duration']),
+                        **{field: data[field] for field in arrayFields})
+
+
+# parse a single file, run in a worker process. Errors are returned rather than
+# raised so one bad file does not abort the whole load. Also returns the parse time
+def parseFile(fileName):
+    start = time.perf_counter()
+    try:
+        return readTcx(fileName), None, time.perf_counter() - start
+    except Exception as e:
+        return None, type(e).__name__ + ': ' + str(e), time.perf_counter() - start
+
+
+class TrackCache:
+    # one npz per activity plus a manifest.json mapping the source path to its
+    # size, mtime and cache entry. A source is only re-parsed when any of these change.
+
+    def __init__(self, cacheFolder):
+        self.cacheFolder = cacheFolder
+        self.manifestFile = os.path.join(cacheFolder, 'manifest.json')
+        self.hits = 0
+        self.misses = 0
+        # seconds taken to parse each file that was not cached
+        self.parseTimes = {}
+
+        if not os.path.isdir(cacheFolder):
+            os.makedirs(cacheFolder)
+
+        self.entries = {}
+        if os.path.isfile(self.manifestFile):
+            with open(self.manifestFile, 'r') as f:
+                manifest = json.load(f)
+            if manifest.get('version') == cacheVersion:
+                self.entries = manifest['entries']
+
+    # cache entries are keyed on the normalised source path
+    @staticmethod
+    def key(fileName):
+        return os.path.normpath(fileName).replace('\\', '/')
+
+    # size and mtime used to detect changed source files
+    @staticmethod
+    def signature(fileName):
+        stat = os.stat(fileName)
+        return stat.st_size, stat.st_mtime_ns
+
+    # return the cached activity, or None if missing or out of date
+    def lookup(self, fileName):
+        entry = self.entries.get(self.key(fileName))
+        if entry is None:
+            return None
+        size, mtime = self.signature(fileName)
+        if entry['size'] != size or entry['mtime'] != mtime:
+            return None
+        try:
+            return loadActivity(os.path.join(self.cacheFolder, entry['file']))
+        except (OSError, KeyError, ValueError):
+            return None
+
+    # add or replace the cache entry for a source file
+    def store(self, fileName, activity):
+        key = self.key(fileName)
+        size, mtime = self.signature(fileName)
+        entryFile = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16] + '.npz'
+        saveActivity(os.path.join(self.cacheFolder, entryFile), activity)
+        self.entries[key] = {'size': size, 'mtime': mtime, 'file': entryFile}
+
+    # load all files, parsing any that are not cached across a pool of jobs processes.
+    # activities are returned in the same order as fileNames, failed files are None
+    # and their errors are returned in the failures dict. Activities with no positioned
+    # points, such as indoor workouts, are cached but returned as failures as there is
+    # nothing to map, unless positioned is False
+    def loadAll(self, fileNames, jobs=1, positioned=True):
+        activities = [self.lookup(fileName) for fileName in fileNames]
+        toParse = [iii for iii in range(0, len(fileNames)) if activities[iii] is None]
+        self.hits += len(fileNames) - len(toParse)
+        self.misses += len(toParse)
+
+        failures = {}
+        pool = None
+        if jobs > 1 and len(toParse) > 1:
+            pool = concurrent.futures.ProcessPoolExecutor(max_workers=min(jobs, len(toParse)))
+            results = pool.map(parseFile, [fileNames[iii] for iii in toParse])
+        else:
+            results = map(parseFile, [fileNames[iii] for iii in toParse])
+
+        try:
+            for count, (iii, (activity, error, seconds)) in enumerate(zip(toParse, results)):
+                print('Loading track ' + str(count + 1) + ' of ' + str(len(toParse)))
+                self.parseTimes[fileNames[iii]] = seconds
+                if error is not None:
+                    failures[fileNames[iii]] = error
+                    continue
+                self.store(fileNames[iii], activity)
+                activities[iii] = activity
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        for iii in range(0, len(fileNames)):
+            if positioned and activities[iii] is not None and len(activities[iii]) == 0:
+                failures[fileNames[iii]] = noPositionError
+                activities[iii] = None
+        return activities, failures
+
+    # remove entries whose source file no longer exists
+    def evictMissing(self):
+        removed = 0
+        for key in list(self.entries.keys()):
+            if not os.path.isfile(key):
+                entryFile = os.path.join(self.cacheFolder, self.entries.pop(key)['file'])
+                if os.path.isfile(entryFile):
+                    os.remove(entryFile)
+                removed += 1
+        return removed
+
+    # write the manifest, via a temporary file so an interrupted run can't corrupt it
+    def save(self):
+        tmpFile = self.manifestFile + '.tmp'
+        with open(tmpFile, 'w') as f:
+            json.dump({'version': cacheVersion, 'entries': self.entries}, f, indent=1, sort_keys=True)
+        os.replace(tmpFile, self.manifestFile)
@@ -0,0 +1,68 @@
+import os
+import json
+import numpy as np
+
+##################################################################
+### GeoJSON sidecar export
+##################################################################
+
+# decimal places kept for coordinates - 5 is about 1 m
+coordinateDecimals = 5
+
+
+# geojson feature for one track, coordinates are [lon, lat]
+def trackFeature(track, info):
+    coordinates = np.round(track[:, ::-1], coordinateDecimals).tolist()
+    return {'type': 'Feature',
+            'geometry': {'type': 'LineString', 'coordinates': coordinates},
+            'properties': {'info': info},
+            }
+
+
+# single FeatureCollection holding every track, for embedding directly in the page
+def trackCollection(tracks, infos):
+    features = [trackFeature(tracks[iii], infos[iii]) for iii in range(0, len(tracks)) if len(tracks[iii]) > 0]
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+# [[south, west], [north, east]] of a track
+def trackBounds(track):
+    return [track.min(axis=0).tolist(), track.max(axis=0).tolist()]
+
+
+# write tracks to geojson files that the map fetches as they come into view.
+# tracks are grouped into chunks of chunkSize degrees by the centre of their bounds,
+# each chunk is one FeatureCollection file. Returns the chunk index to embed in the page
+# as a list of {'url', 'bounds'} in the same order the files were written.
+def writeSidecar(tracks, infos, outFolder, chunkSize):
+    if not os.path.isdir(outFolder):
+        os.makedirs(outFolder)
+
+    # remove chunks from a previous build
+    for file in os.listdir(outFolder):
+        if file.startswith('chunk_') and file.endswith('.json'):
+            os.remove(os.path.join(outFolder, file))
+
+    chunks = {}
+    for iii in range(0, len(tracks)):
+        if len(tracks[iii]) == 0:
+            continue
+        bounds = trackBounds(tracks[iii])
+        centre = (np.array(bounds[0]) + np.array(bounds[1])) / 2
+        key = tuple(np.floor(centre / chunkSize).astype(int).tolist())
+        if key not in chunks:
+            chunks[key] = {'features': [], 'bounds': bounds}
+        chunk = chunks[key]
+        chunk['features'].append(trackFeature(tracks[iii], infos[iii]))
+        chunk['bounds'] = [np.minimum(chunk['bounds'][0], bounds[0]).tolist(),
+                           np.maximum(chunk['bounds'][1], bounds[1]).tolist()]
+
+    index = []
+    for count, key in enumerate(sorted(chunks.keys())):
+        fileName = os.path.join(outFolder, 'chunk_' + str(count) + '.json')
+        with open(fileName, 'w') as f:
+            json.dump({'type': 'FeatureCollection', 'features': chunks[key]['features']},
+                      f, separators=(',', ':'))
+        index.append({'url': fileName.replace('\\', '/'), 'bounds': chunks[key]['bounds']})
+
+    return index
@@ -0,0 +1,228 @@
+import os
+import numpy as np
+from trackSimplify import earthRadius
+from trackStats import haversine, packActivities
+from trackCache import TrackCache
+
+##################################################################
+### Grid index over all track points
+##################################################################
+
+# side of a grid cell. Points are 1-2 s apart so a walk never skips a cell
+cellSize = 100 # m
+
+# two walks follow the same route when this fraction of the cells either covers
+# is covered by both (cells in common over cells in either)
+routeOverlap = 0.7
+
+# repeated routes are found by comparing min-hash signatures of each walk's cells.
+# walks that agree on all hashes of any band of routeBandRows are compared exactly
+routeHashes = 32
+routeBandRows = 4
+
+# bump when the cell layout changes to rebuild the saved index
+indexVersion = 1
+
+
+# id of a parsed track, changes whenever the source file does
+def activityId(fileName):
+    size, mtime = TrackCache.signature(fileName)
+    return TrackCache.key(fileName) + '@' + str(size) + '-' + str(mtime)
+
+
+# grid row of each latitude. Rows are cellSize high everywhere
+def cellRows(latitude):
+    return np.floor(np.radians(latitude) * earthRadius / cellSize).astype(np.int64)
+
+
+# grid column of each longitude within its row. Columns are cellSize wide at the
+# middle of the row, so cells are close to square at any latitude
+def cellColumns(longitude, rows):
+    scale = np.cos((rows + 0.5) * cellSize / earthRadius)
+    return np.floor(np.radians(longitude) * earthRadius * scale / cellSize).astype(np.int64)
+
+
+# single sortable key per cell, ordered by row then column
+def cellKeys(rows, columns):
+    return (rows << 32) + (columns + (1 << 31))
+
+
+# latitude and longitude of the centre of each cell key
+def cellCentres(keys):
+    rows = keys >> 32
+    columns = (keys & 0xffffffff) - (1 << 31)
+    latitude = (rows + 0.5) * cellSize / earthRadius
+    longitude = (columns + 0.5) * cellSize / earthRadius / np.cos(latitude)
+    return np.degrees(latitude), np.degrees(longitude)
+
+
+class TrackIndex:
+    # every (cell, activity) pair of the grid cells each walk passes through, sorted by
+    # cell. Cell keys sort by row then column, so the cells of one row between two
+    # columns are a contiguous run of pairs found with two binary searches.
+    # Activities are positions in ids, which lines up with the list of loaded tracks
+
+    def __init__(self):
+        self.ids = []
+        self.cells = np.zeros(0, dtype=np.int64)
+        self.activities = np.zeros(0, dtype=np.int64)
+
+    # read an index written by save, an empty index if missing or out of date
+    @staticmethod
+    def load(fileName):
+        index = TrackIndex()
+        if not os.path.isfile(fileName):
+            return index
+        with np.load(fileName) as data:
+            if int(data['version']) != indexVersion or float(data['cellSize']) != cellSize:
+                return index
+            index.ids = data['ids'].tolist()
+            index.cells = data['cells']
+            index.activities = data['activities']
+        return index
+
+    # write the index, via a temporary file so an interrupted run can't corrupt it
+    def save(self, fileName):
+        folder = os.path.dirname(fileName)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        tmpFile = fileName + '.tmp.npz'
+        np.savez(tmpFile, version=np.array(indexVersion), cellSize=np.array(cellSize),
+                 ids=np.array(self.ids, dtype=str), cells=self.cells, activities=self.activities)
+        os.replace(tmpFile, fileName)
+
+    # bring the index in line with the given tracks, ids[i] being the id of dataSets[i].
+    # Cells of tracks already indexed are kept, only new or changed tracks are binned.
+    # Returns True if anything changed
+    def update(self, ids, dataSets):
+        position = {id: iii for iii, id in enumerate(ids)}
+        remap = np.array([position.get(id, -1) for id in self.ids], dtype=np.int64)
+        kept = remap[self.activities] if len(self.activities) > 0 else self.activities
+        keep = kept >= 0
+        cells = self.cells[keep]
+        activities = kept[keep]
+
+        known = set(self.ids)
+        new = [iii for iii in range(0, len(ids)) if ids[iii] not in known]
+        if len(new) == 0 and len(self.ids) == len(ids) and np.all(remap == np.arange(len(ids))):
+            return False
+
+        if len(new) > 0:
+            offsets, activityIndex, columns = packActivities([dataSets[iii] for iii in new])
+            rows = cellRows(columns['latitude'])
+            newCells = cellKeys(rows, cellColumns(columns['longitude'], rows))
+            newActivities = np.array(new, dtype=np.int64)[activityIndex]
+            cells = np.concatenate((cells, newCells))
+            activities = np.concatenate((activities, newActivities))
+
+        # sort by cell and drop repeated points of a walk in the same cell
+        order = np.lexsort((activities, cells))
+        cells = cells[order]
+        activities = activities[order]
+        unique = np.concatenate(([True], (cells[1:] != cells[:-1]) | (activities[1:] != activities[:-1])))
+        self.ids = list(ids)
+        self.cells = cells[unique]
+        self.activities = activities[unique]
+        return True
+
+    # activities with a cell in any row between its low and high columns (inclusive)
+    def searchRows(self, rows, low, high):
+        start = np.searchsorted(self.cells, cellKeys(rows, low), side='left')
+        end = np.searchsorted(self.cells, cellKeys(rows, high), side='right')
+        found = [self.activities[s:e] for s, e in zip(start, end) if e > s]
+        return np.unique(np.concatenate(found)) if found else np.zeros(0, dtype=np.int64)
+
+    # activities passing within radius metres of a point. Without dataSets the answer
+    # comes from the cells alone and may include walks up to a cell further away,
+    # with them each candidate is checked against its points
+    def near(self, latitude, longitude, radius, dataSets=None):
+        rows = np.arange(cellRows(np.degrees((np.radians(latitude) * earthRadius - radius) / earthRadius)),
+                         cellRows(np.degrees((np.radians(latitude) * earthRadius + radius) / earthRadius)) + 1)
+        spread = np.degrees(radius / earthRadius / np.cos(np.radians(abs(latitude)) + radius / earthRadius))
+        candidates = self.searchRows(rows, cellColumns(np.full(len(rows), longitude - spread), rows),
+                                     cellColumns(np.full(len(rows), longitude + spread), rows))
+        if dataSets is None:
+            return candidates
+        return np.array([iii for iii in candidates if
+                         haversine(latitude, longitude, dataSets[iii].latitude, dataSets[iii].longitude).min() <= radius],
+                        dtype=np.int64)
+
+    # activities with points inside a box. Without dataSets the answer comes from the
+    # cells alone and may include walks that only pass through a cell on the edge
+    def inBox(self, south, west, north, east, dataSets=None):
+        rows = np.arange(cellRows(south), cellRows(north) + 1)
+        candidates = self.searchRows(rows, cellColumns(np.full(len(rows), west), rows),
+                                     cellColumns(np.full(len(rows), east), rows))
+        if dataSets is None:
+            return candidates
+        inside = lambda d: np.any((d.latitude >= south) & (d.latitude <= north) & (d.longitude >= west) & (d.longitude <= east))
+        return np.array([iii for iii in candidates if inside(dataSets[iii])], dtype=np.int64)
+
+    # distinct cells covered by the selected activities, all activities if None
+    def coveredCells(self, selected=None):
+        if selected is None:
+            return np.unique(self.cells)
+        return np.unique(self.cells[np.isin(self.activities, selected)])
+
+    # cell passed through by the most walks and the number of walks, None if empty
+    def busiestCell(self, selected=None):
+        cells = self.cells if selected is None else self.cells[np.isin(self.activities, selected)]
+        if len(cells) == 0:
+            return None, 0
+        keys, counts = np.unique(cells, return_counts=True)
+        return keys[np.argmax(counts)], counts.max()
+
+    # groups of walks that follow the same route, largest first. Each walk's cells get
+    # a min-hash signature, walks agreeing on a whole band of it are candidates and are
+    # checked exactly against the first walk of their band group
+    def repeatedRoutes(self, selected=None):
+        keep = np.ones(len(self.cells), dtype=bool) if selected is None else np.isin(self.activities, selected)
+        order = np.lexsort((self.cells[keep], self.activities[keep]))
+        cells = self.cells[keep][order].astype(np.uint64)
+        activities = self.activities[keep][order]
+        if len(cells) == 0:
+            return []
+        starts = np.flatnonzero(np.concatenate(([True], activities[1:] != activities[:-1])))
+        ends = np.append(starts[1:], len(cells))
+        walks = activities[starts]
+
+        # multiplying by an odd number and adding a constant shuffles the 64 bit keys
+        random = np.random.default_rng(0)
+        signature = np.empty((len(walks), routeHashes), dtype=np.uint64)
+        for hhh in range(0, routeHashes):
+            multiplier, offset = random.integers(0, 1 << 63, size=2, dtype=np.uint64)
+            hashed = cells * (multiplier | np.uint64(1)) + offset
+            hashed ^= hashed >> np.uint64(29)
+            signature[:, hhh] = np.minimum.reduceat(hashed, starts)
+
+        # union-find over walks in the same route
+        parent = np.arange(len(walks))
+        def root(iii):
+            while parent[iii] != iii:
+                parent[iii] = parent[parent[iii]]
+                iii = parent[iii]
+            return iii
+
+        compared = set()
+        for band in range(0, routeHashes // routeBandRows):
+            _, groups = np.unique(signature[:, band * routeBandRows:(band + 1) * routeBandRows],
+                                  axis=0, return_inverse=True)
+            order = np.argsort(groups, kind='stable')
+            bounds = np.flatnonzero(np.diff(groups[order])) + 1
+            for members in np.split(order, bounds):
+                first = members[0]
+                for other in members[1:]:
+                    if (first, other) in compared or root(first) == root(other):
+                        continue
+                    compared.add((first, other))
+                    shared = len(np.intersect1d(cells[starts[first]:ends[first]], cells[starts[other]:ends[other]],
+                                                assume_unique=True))
+                    either = (ends[first] - starts[first]) + (ends[other] - starts[other]) - shared
+                    if shared >= routeOverlap * either:
+                        parent[root(other)] = root(first)
+
+        routes = {}
+        for iii in range(0, len(walks)):
+            routes.setdefault(root(iii), []).append(int(walks[iii]))
+        routes = [sorted(route) for route in routes.values() if len(route) > 1]
+        return sorted(routes, key=lambda route: (-len(route), route[0]))
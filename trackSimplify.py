@@ -0,0 +1,61 @@
+import numpy as np
+
+##################################################################
+### Track simplification
+##################################################################
+
+# mean earth radius in metres
+earthRadius = 6371008.8
+
+
+# project lat/lon in degrees to local x/y in metres, an equirectangular
+# projection about the mean latitude is plenty accurate over a single walk
+def projectTrack(latitude, longitude):
+    lat0 = np.radians(np.mean(latitude))
+    x = np.radians(longitude) * earthRadius * np.cos(lat0)
+    y = np.radians(latitude) * earthRadius
+    return x, y
+
+
+# Ramer-Douglas-Peucker simplification. Returns the indices of the points to keep so
+# other point arrays (time, elevation) can be sliced the same way. Points are dropped
+# if they are within tolerance metres of the segment joining the kept points either side.
+# The distance to each candidate segment is computed in one numpy pass, only the
+# segment splitting is done in python.
+def simplifyTrack(latitude, longitude, tolerance):
+    n = len(latitude)
+    if n < 3:
+        return np.arange(n)
+
+    x, y = projectTrack(latitude, longitude)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = True
+    keep[-1] = True
+
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+
+        # distance from each inner point to the segment start-end. Use the distance to the
+        # segment rather than the infinite line so out and back walks are kept
+        dx = x[end] - x[start]
+        dy = y[end] - y[start]
+        px = x[start + 1:end] - x[start]
+        py = y[start + 1:end] - y[start]
+        length2 = dx * dx + dy * dy
+        if length2 > 0:
+            t = np.clip((px * dx + py * dy) / length2, 0, 1)
+        else:
+            t = 0
+        dist = np.hypot(px - t * dx, py - t * dy)
+
+        iii = np.argmax(dist)
+        if dist[iii] > tolerance:
+            split = start + 1 + iii
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+
+    return np.flatnonzero(keep)
@@ -0,0 +1,103 @@
+import numpy as np
+from trackSimplify import earthRadius
+
+##################################################################
+### Per-track statistics
+##################################################################
+
+# a segment between two points counts as moving above this speed
+movingSpeed = 0.4 # m/s
+
+# elevation is smoothed with a centred moving average over this many points each side
+# to stop GPS altitude noise adding up to phantom climbing
+elevationHalfWindow = 10
+
+# distance used for the best sustained pace
+sustainedDistance = 1000 # m
+
+
+# great circle distance in metres between arrays of points in degrees
+def haversine(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = np.radians(lat1), np.radians(lon1), np.radians(lat2), np.radians(lon2)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * earthRadius * np.arcsin(np.sqrt(a))
+
+
+# concatenate the point arrays of all activities. offsets[i]:offsets[i + 1] are the
+# points of activity i, and activityIndex gives the activity of every point
+def packActivities(activities):
+    lengths = np.array([len(activity) for activity in activities], dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    columns = {}
+    for field in ('latitude', 'longitude', 'elevation', 'time'):
+        arrays = [getattr(activity, field) for activity in activities]
+        columns[field] = np.concatenate(arrays) if arrays else np.zeros(0)
+    activityIndex = np.repeat(np.arange(len(activities)), lengths)
+    return offsets, activityIndex, columns
+
+
+# centred moving average that ignores NaNs and does not cross activity boundaries
+def smoothElevation(elevation, offsets, activityIndex, halfWindow):
+    valid = np.isfinite(elevation)
+    sums = np.concatenate(([0], np.cumsum(np.where(valid, elevation, 0))))
+    counts = np.concatenate(([0], np.cumsum(valid)))
+
+    index = np.arange(len(elevation))
+    low = np.maximum(index - halfWindow, offsets[:-1][activityIndex])
+    high = np.minimum(index + halfWindow + 1, offsets[1:][activityIndex])
+    count = counts[high] - counts[low]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count > 0, (sums[high] - sums[low]) / count, np.nan)
+
+
+# compute statistics for all activities at once from their point arrays.
+# returns a dict of arrays with one value per activity
+#   haversineDistance - sum of great circle distances between points, m
+#   movingTime        - time spent on segments faster than movingSpeed, s
+#   stoppedTime       - time spent on slower segments, s
+#   elevationGain     - total climb of the smoothed elevation, m
+#   elevationLoss     - total descent of the smoothed elevation, m
+#   bestPace          - fastest time over any sustainedDistance stretch, min/km (NaN if shorter)
+def computeStats(activities):
+    count = len(activities)
+    offsets, activityIndex, columns = packActivities(activities)
+    latitude = columns['latitude']
+    longitude = columns['longitude']
+    time = columns['time']
+
+    # segments between consecutive points, those spanning two activities are zeroed
+    segmentActivity = activityIndex[:-1]
+    sameActivity = activityIndex[:-1] == activityIndex[1:]
+    distance = np.where(sameActivity, haversine(latitude[:-1], longitude[:-1], latitude[1:], longitude[1:]), 0)
+    duration = np.where(sameActivity, np.diff(time), 0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        speed = np.where(duration > 0, distance / duration, 0)
+    moving = sameActivity & (speed >= movingSpeed)
+
+    stats = {}
+    stats['haversineDistance'] = np.bincount(segmentActivity, weights=distance, minlength=count)
+    stats['movingTime'] = np.bincount(segmentActivity, weights=np.where(moving, duration, 0), minlength=count)
+    stats['stoppedTime'] = np.bincount(segmentActivity, weights=np.where(moving, 0, duration), minlength=count)
+
+    # elevation change of the smoothed profile
+    elevation = smoothElevation(columns['elevation'], offsets, activityIndex, elevationHalfWindow)
+    climb = np.diff(elevation)
+    climb = np.where(sameActivity & np.isfinite(climb), climb, 0)
+    stats['elevationGain'] = np.bincount(segmentActivity, weights=np.clip(climb, 0, None), minlength=count)
+    stats['elevationLoss'] = np.bincount(segmentActivity, weights=np.clip(-climb, 0, None), minlength=count)
+
+    # best sustained pace - for every point find the first point at least sustainedDistance further on.
+    # cumulative distance across all activities is monotonic so one searchsorted covers them all
+    cumulative = np.concatenate(([0], np.cumsum(distance)))
+    end = np.searchsorted(cumulative, cumulative + sustainedDistance, side='left')
+    valid = end < offsets[1:][activityIndex]
+    start = np.flatnonzero(valid)
+    end = end[valid]
+    elapsed = time[end] - time[start]
+    pace = elapsed / (cumulative[end] - cumulative[start]) * 1000 / 60
+    bestPace = np.full(count, np.inf)
+    np.minimum.at(bestPace, activityIndex[start], np.where(elapsed > 0, pace, np.inf))
+    stats['bestPace'] = np.where(np.isfinite(bestPace), bestPace, np.nan)
+
+    return stats
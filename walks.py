@@ -0,0 +1,92 @@
+import os
+import argparse
+
+##################################################################
+### Command line for each stage of the build
+##################################################################
+
+# each command imports only the modules its stage needs, so e.g. stats never loads
+# folium or bokeh
+#   download - fetch new tcx files from MapMyRun (downloadData.py)
+#   parse    - parse new and changed tcx files into the track cache
+#   stats    - print yearly totals from the track cache
+#   render   - build the pages (plotWalkData.py)
+
+def download(args):
+    import downloadData
+    downloadData.connections = args.connections
+    downloadData.sync(args.years if args.years else downloadData.years, baseUrl=args.base_url,
+                      cookie=args.cookie, dryRun=args.dry_run)
+
+
+def parse(args):
+    import plotWalkData
+    dataFiles, ids, archived = plotWalkData.findTracks(args.years if args.years else plotWalkData.findYears())
+    plotWalkData.loadAllTracks(dataFiles, archived, jobs=args.jobs)
+
+
+# totals per year of the activities in the track cache, files not parsed yet are parsed first
+def stats(args):
+    import plotWalkData
+    from trackStats import computeStats
+    from activityTable import buildActivityTable
+
+    dataFiles, ids, archived = plotWalkData.findTracks(args.years if args.years else plotWalkData.findYears())
+    dataSets, loadedFiles = plotWalkData.loadAllTracks(dataFiles, archived, jobs=args.jobs)
+    if len(dataSets) == 0:
+        print('No tracks found')
+        return
+    table = buildActivityTable(dataSets, computeStats(dataSets))
+    totals = table.groupby('year').agg(walks=('name', 'size'), distance=('distance', 'sum'),
+                                       moving=('moving', 'sum'), climb=('climb', 'sum'))
+
+    print('{:<6} {:>6} {:>14} {:>12} {:>10}'.format('Year', 'Walks', 'Distance (km)', 'Moving (h)', 'Climb (m)'))
+    for rowYear, row in totals.iterrows():
+        print('{:<6} {:>6} {:>14.1f} {:>12.1f} {:>10.0f}'.format(rowYear, int(row['walks']), row['distance'],
+                                                                row['moving'], row['climb']))
+    if len(totals) > 1:
+        print('{:<6} {:>6} {:>14.1f} {:>12.1f} {:>10.0f}'.format('All', totals['walks'].sum(), totals['distance'].sum(),
+                                                                totals['moving'].sum(), totals['climb'].sum()))
+
+
+def render(args):
+    import plotWalkData
+    plotWalkData.year = args.year if args.year else plotWalkData.year
+    plotWalkData.build(args.years, jobs=args.jobs, watching=args.watch, profile=args.profile,
+                       profileDump=args.profile_dump)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Download, parse, summarise and build the walk pages')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('download', help='download tcx files for workouts in the MapMyRun history exports')
+    command.add_argument('--years', type=int, nargs='+', default=None,
+                         help='years to download (default: the years set in downloadData.py)')
+    command.add_argument('--connections', type=int, default=4, help='number of concurrent downloads (default: %(default)s)')
+    command.add_argument('--base-url', default=None,
+                         help='fetch exports from this server instead of the one in the workout link')
+    command.add_argument('--cookie', default=os.environ.get('MAPMYRUN_COOKIE'),
+                         help='Cookie header of a logged in browser session (default: $MAPMYRUN_COOKIE)')
+    command.add_argument('--dry-run', action='store_true', help='only list the workouts that would be fetched')
+    command.set_defaults(run=download)
+
+    for name, run, description in [('parse', parse, 'parse new and changed tcx files into the track cache'),
+                                   ('stats', stats, 'print yearly totals of the parsed tracks'),
+                                   ('render', render, 'build the walk pages')]:
+        command = commands.add_parser(name, help=description)
+        command.add_argument('--years', type=int, nargs='+', default=None,
+                             help='years to use (default: every year in the data folder)')
+        command.add_argument('--jobs', type=int, default=os.cpu_count(),
+                             help='number of processes used to parse tracks (default: number of cores)')
+        command.set_defaults(run=run)
+    command.add_argument('--year', type=int, default=None,
+                         help='year written to index.html (default: the year set in plotWalkData.py)')
+    command.add_argument('--watch', action='store_true',
+                         help='keep running and rebuild the pages when tcx files, archives or pictures change')
+    command.add_argument('--profile', action='store_true',
+                         help='print the time and memory used by each stage and the slowest files to parse')
+    command.add_argument('--profile-dump', default=None, metavar='FILE',
+                         help='also write cProfile stats of the build to FILE, for pstats or snakeviz')
+
+    args = parser.parse_args()
+    args.run(args)